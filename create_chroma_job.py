@@ -1,62 +1,242 @@
-#!env python
+#!/usr/bin/env python
+"""
+Create SLURM scripts running chroma. The scripts are created either one at a time from the
+commandline options or in bulk from a stream of job descriptions read from the standard input.
+"""
 
-import argparser
+import argparse
 import functools
+import io
+import json
 import operator
+import os
+import string
+import subprocess
+import sys
+import tempfile
 import kaon
+import runtime_table
 
+#
+# Templates
+#
 
-def output_chroma_shell_job(chroma_args, geom, output_files, nodes, maxtime, job_name, output, facility_name, filename):
-    """
-    Output a script
-    """
-
-    # Get schema
-    facilities_schema = kaon.get_schema_from_json("facilities.json")
-    kaon.check_schema(facilities_schema)
-    facility = kaon.execute_schema(facilities_schema, {'facility': [faciltity_name]})
-    if len(facility) == 0:
-        raise Exception(
-            'The facility `{}` does not appear in `facilities.json`'.format(facility_name))
-    facility = facility[0]
-    sbatch_extra = facility['sbatch_extra']
-    chroma_env = facility['chroma_env']
-    procs = functool.reduce(operator.mul, [int(x) for x in geom.split()], 1)
-    num_cores = int(facility['num_cores'])
-    cores_per_process = num_cores * int(nodes) // procs
-    output_files = " ".join(output_files)
-    chroma_args = " ".join(chroma_args)
-
-    with open(filename, 'wt') as fd:
-        fd.write(f"""
-#!/bin/bash
+CHROMA_JOB_TEMPLATE = """#!/bin/bash
 #SBATCH -t {maxtime} --nodes={nodes} -n {procs} -J {job_name}
 #SBATCH {sbatch_extra}
 #KAON_BATCH -t {maxtime} --nodes={nodes} -n {procs} {sbatch_extra}
+#KAON_JOB {job_class}
 
-run() {
+run() {{
 source {chroma_env}
 export MKL_NUM_THREADS={cores_per_process}
 export OMP_NUM_THREADS={cores_per_process}
 
 rm -f {output_files}
-echo RUNNING chroma > {output}
-{chroma_srun} -n {procs} $MY_OFFSET {chroma_bin} {chroma_args} {chroma_extra_args} -geom {geom} >> {output} && echo FINISHED chroma >> {output}
-}
-check() {
+echo RUNNING chroma `date +%s` > {output}
+{chroma_srun} -n {procs} $MY_OFFSET {chroma_bin} {chroma_args} {chroma_extra_args} -geom {geom} >> {output} && echo FINISHED chroma `date +%s` >> {output}
+}}
+check() {{
     grep -q "FINISHED chroma" {output} && exit 0
     exit 1
-}
-if [ $2 == run ]; then
+}}
+if [ $1 == run ]; then
     run
-elif [ $2 == check ]; then
+elif [ $1 == check ]; then
     check
-elif [ $2 == out ]; then
+elif [ $1 == out ]; then
     ls {output_files} 2>/dev/null || true
 else
     exit 1
 fi
-""")
+"""
+
+EIGS_XML_TEMPLATE = """<?xml version="1.0"?>
+<chroma>
+ <Param>
+  <InlineMeasurements>
+    <elem>
+      <Name>CREATE_COLORVECS_SUPERB</Name>
+      <Frequency>1</Frequency>
+      <Param>
+        <num_vecs>{default_num_vecs}</num_vecs>
+        <decay_dir>3</decay_dir>
+        <write_fingerprint>true</write_fingerprint>
+        <LinkSmearing>
+          <LinkSmearingType>STOUT_SMEAR</LinkSmearingType>
+          <link_smear_fact>{smear_fact}</link_smear_fact>
+          <link_smear_num>{smear_num}</link_smear_num>
+          <no_smear_dir>3</no_smear_dir>
+        </LinkSmearing>
+      </Param>
+      <NamedObject>
+        <gauge_id>default_gauge_field</gauge_id>
+        <colorvec_out>{eig_default_file}</colorvec_out>
+      </NamedObject>
+    </elem>
+  </InlineMeasurements>
+  <nrow>{space_size} {space_size} {space_size} {time_size}</nrow>
+  </Param>
+  <RNG>
+    <Seed>
+      <elem>2551</elem>
+      <elem>3189</elem>
+      <elem>2855</elem>
+      <elem>707</elem>
+    </Seed>
+  </RNG>
+  <Cfg>
+    <cfg_type>SCIDAC</cfg_type>
+    <cfg_file>{cfg_file}</cfg_file>
+    <parallel_io>true</parallel_io>
+  </Cfg>
+</chroma>
+"""
+
+
+def compile_template(template):
+    """
+    Return the template split into a list of (literal text, field name) pairs, so that rendering
+    the template many times doesn't parse it again.
+    """
+
+    return [(literal, field) for literal, field, _, _ in string.Formatter().parse(template)]
+
+
+def render_template(compiled_template, values):
+    """
+    Return the compiled template with the fields replaced by the values.
+    """
+
+    return "".join([literal + (str(values[field]) if field is not None else "")
+                    for literal, field in compiled_template])
+
+
+chroma_job_template = compile_template(CHROMA_JOB_TEMPLATE)
+eigs_xml_template = compile_template(EIGS_XML_TEMPLATE)
+
+#
+# Jobs
+#
+
+
+@functools.lru_cache(maxsize=None)
+def get_facility(facility_name, facilities_file="facilities.json"):
+    """
+    Return the properties of the facility from `facilities.json`.
+    """
+
+    facilities_schema = kaon.get_schema_from_json([facilities_file])
+    facility = [entry for entry in kaon.execute_schema(facilities_schema,
+                                                       [{'facility': {facility_name}}], {})
+                if 'facility' in entry and 'num_cores' in entry]
+    if len(facility) == 0:
+        raise Exception(
+            'The facility `{}` does not appear in `{}`'.format(facility_name, facilities_file))
+    return facility[0]
+
+
+def get_num_procs(geom):
+    """
+    Return the number of processes of a job with the given geometry, eg. `1 1 2 4`.
+    """
+
+    return functools.reduce(operator.mul, [int(x) for x in geom.split()], 1)
+
+
+def get_chroma_shell_job(chroma_args, geom, output_files, nodes, maxtime, job_name, output,
+                         facility, job_class=None):
+    """
+    Return the content of a script running chroma in the facility. Jobs of the same class share
+    the runtime statistics, see `runtime_table.py`; by default, the class is the job name.
+    """
+
+    procs = get_num_procs(geom)
+    num_cores = int(facility['num_cores'])
+    return render_template(chroma_job_template, dict(
+        facility,
+        maxtime=maxtime,
+        nodes=nodes,
+        procs=procs,
+        job_name=job_name,
+        job_class=job_class or job_name,
+        cores_per_process=num_cores * int(nodes) // procs,
+        output_files=" ".join(output_files),
+        output=output,
+        chroma_args=" ".join(chroma_args),
+        geom=geom))
+
+
+def output_chroma_shell_job(chroma_args, geom, output_files, nodes, maxtime, job_name, output,
+                            facility_name, filename):
+    """
+    Output a script
+    """
+
+    with open(filename, 'wt') as fd:
+        fd.write(get_chroma_shell_job(chroma_args, geom, output_files, nodes, maxtime, job_name,
+                                      output, get_facility(facility_name)))
+
+
+def read_job_descriptions(f, input_format):
+    """
+    Return the job descriptions from a KaoN schema, like the output of `kaon.py --output-format
+    schema`, or from a file with a JSON object in each line.
+    """
+
+    if input_format == 'ndjson':
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+        return
+
+    schema = json.load(f)
+    kaon.check_schema(schema)
+    for action in schema:
+        for modify_item in kaon.make_a_list(action.get('modify', [])):
+            yield from kaon.modify_entry({}, modify_item)
+
+
+def output_eigs_jobs(jobs, facility, runtimes=None):
+    """
+    Output the chroma input and the script for each job computing eigenvectors. Return the number
+    of scripts created. If a runtime table is given, the number of nodes and the maximum time are
+    the ones recommended from the previous jobs on the same ensemble, among the numbers of nodes
+    that fit the geometry of the job.
+    """
+
+    node_type = facility['node_type']
+    num_jobs = 0
+    for job in jobs:
+        # Skip entries that aren't describing an eigenvector job
+        if 'eig_default_run' not in job:
+            continue
+        try:
+            runpath = job['eig_default_run']
+            geom = job[f'eig_{node_type}_geom']
+            nodes = job[f'eig_{node_type}_num_nodes']
+            maxtime = job[f'eig_{node_type}_maxtime']
+            job_class = f"eigs {job['ens_name']}"
+            xml = render_template(eigs_xml_template, job)
+        except KeyError as e:
+            raise Exception(f"Missing property {e} in eigenvector job {job}") from e
+        if runtimes is not None:
+            nodes, maxtime = runtime_table.recommend(
+                runtimes, facility['facility'], job_class, nodes, maxtime,
+                procs=get_num_procs(geom), cores_per_node=int(facility['num_cores']))
+
+        os.makedirs(os.path.dirname(runpath) or ".", exist_ok=True)
+        if not os.path.exists(f"{runpath}.xml"):
+            with open(f"{runpath}.xml", 'wt') as fd:
+                fd.write(xml)
+        with open(f"{runpath}.sh", 'wt') as fd:
+            fd.write(get_chroma_shell_job(
+                chroma_args=["-i", f"{runpath}.xml"], geom=geom,
+                output_files=[job['eig_default_file']], nodes=nodes,
+                maxtime=maxtime, job_name=runpath.replace("/", "-"), output=f"{runpath}.out",
+                facility=facility, job_class=job_class))
+        num_jobs += 1
+    return num_jobs
 
 
 def process_args():
@@ -64,26 +244,127 @@ def process_args():
     Parser commandline arguments and do the thing
     """
 
-    parser = argprarse.ArgumentParser(description="Create a slurm job")
+    parser = argparse.ArgumentParser(description="Create a slurm job")
+    parser.add_argument("--batch", required=False, nargs=1, choices=['eigs'],
+                        help="Create the jobs described in the standard input; the chroma input "
+                        "files are created too")
+    parser.add_argument("--input-format", required=False, nargs=1, choices=['schema', 'ndjson'],
+                        default=['schema'],
+                        help="format of the job descriptions with --batch: KaoN schema (schema) "
+                        "or a JSON object per line (ndjson)")
+    parser.add_argument("--runtime-table", required=False, nargs=1,
+                        help="Size the jobs with --batch from the runtimes of previous jobs in "
+                        "this table; see runtime_table.py")
     parser.add_argument("--output-files", required=False, nargs='+',
                         help="Files to be removed before the execution", default=[])
-    parser.add_argument("--chroma-arguments", required=True, nargs='+',
+    parser.add_argument("--chroma-arguments", required=False, nargs='+',
                         help="Launch a chroma job with these arguments", default=[])
-    parser.add_argument("--geom", required=True, nargs=4,
+    parser.add_argument("--geom", required=False, nargs=4,
                         help="Number of processes in each lattice direction")
     parser.add_argument("--facility", required=True, nargs=1, help="This facility name")
-    parser.add_argument("--job-output", required=True, nargs=1,
+    parser.add_argument("--job-output", required=False, nargs=1,
                         help="Full path of the job's output")
-    parser.add_argument("--nodes", required=True, nargs=1, type=int,
+    parser.add_argument("--nodes", required=False, nargs=1, type=int,
                         help="Number of nodes running chroma")
-    parser.add_argument("--maxtime", required=True, nargs=1, help="Maximum time of the job")
-    parser.add_argument("--job-name", nargs=1, required=False, help="Job name", default="chroma")
-    parser.add_argument("--output-shell-file", nargs=1, required=True,
+    parser.add_argument("--maxtime", required=False, nargs=1, help="Maximum time of the job")
+    parser.add_argument("--job-name", nargs=1, required=False, help="Job name",
+                        default=["chroma"])
+    parser.add_argument("--output-shell-file", nargs=1, required=False,
                         help="filename of the created the shell script")
     args = parser.parse_args()
-    output_chroma_shell_jobs(chroma_args=args.chroma_arguments, geom=args.geom, remove_files=args.output_files, nodes=args.nodes,
-                             maxtime=args.maxtime, job_name=args.job_name, output=args.job_output, facility_name=args.facitlity, filename=args.output_shell_file)
+
+    if args.batch:
+        runtimes = (runtime_table.read_table(args.runtime_table[0])
+                    if args.runtime_table else None)
+        num_jobs = output_eigs_jobs(read_job_descriptions(sys.stdin, args.input_format[0]),
+                                    get_facility(args.facility[0]), runtimes)
+        sys.stderr.write(f"Created {num_jobs} job(s)\n")
+        return
+
+    for option in ('chroma_arguments', 'geom', 'job_output', 'nodes', 'maxtime',
+                   'output_shell_file'):
+        if not getattr(args, option):
+            parser.error(f"the option --{option.replace('_', '-')} is required without --batch")
+    output_chroma_shell_job(chroma_args=args.chroma_arguments, geom=" ".join(args.geom),
+                            output_files=args.output_files, nodes=args.nodes[0],
+                            maxtime=args.maxtime[0], job_name=args.job_name[0],
+                            output=args.job_output[0], facility_name=args.facility[0],
+                            filename=args.output_shell_file[0])
+
+
+def do_test():
+    """
+    Minimal tests.
+    """
+
+    # The compiled templates render as str.format
+    values = {'default_num_vecs': 64, 'smear_fact': 0.08, 'smear_num': 10,
+              'eig_default_file': "d/eig.mod1", 'space_size': 32, 'time_size': 64,
+              'cfg_file': "d/cfg1.lime"}
+    assert render_template(eigs_xml_template, values) == EIGS_XML_TEMPLATE.format(**values)
+
+    # The job descriptions are read from a schema or from a JSON object per line
+    jobs = [{'eig_default_run': "r/eigs.cnf1", 'ens_name': "e", 'eig_32cpu_geom': "1 1 2 2",
+             'eig_32cpu_num_nodes': "2", 'eig_32cpu_maxtime': "1:00:00", **values},
+            {'eig_default_run': "r/eigs.cnf2", 'ens_name': "e", 'eig_32cpu_geom': "1 1 2 2",
+             'eig_32cpu_num_nodes': "2", 'eig_32cpu_maxtime': "1:00:00",
+             **dict(values, eig_default_file="d/eig.mod2")},
+            {'kind': "configuration"}]
+    jobs = [{k: str(v) for k, v in job.items()} for job in jobs]
+    ndjson = "".join([json.dumps(job) + "\n" for job in jobs])
+    assert list(read_job_descriptions(io.StringIO(ndjson), 'ndjson')) == jobs
+    schema = json.dumps([{'modify': jobs}])
+    assert list(read_job_descriptions(io.StringIO(schema), 'schema')) == jobs
+
+    # A chroma input and a script are created for each eigenvector job
+    facility = {'facility': "test", 'node_type': "32cpu", 'num_cores': "32",
+                'chroma_env': "/dev/null", 'chroma_srun': "srun", 'chroma_bin': "chroma",
+                'chroma_extra_args': "", 'sbatch_extra': ""}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cwd = os.getcwd()
+        os.chdir(tmpdir)
+        try:
+            assert output_eigs_jobs(iter(jobs), facility) == 2
+            with open("r/eigs.cnf1.xml", 'rt') as f:
+                assert f.read() == EIGS_XML_TEMPLATE.format(**jobs[0])
+            with open("r/eigs.cnf1.sh", 'rt') as f:
+                script = f.read()
+            assert "#SBATCH -t 1:00:00 --nodes=2 -n 4 -J r-eigs.cnf1\n" in script
+            assert "#KAON_JOB eigs e\n" in script
+            assert "export OMP_NUM_THREADS=16\n" in script
+            assert "rm -f d/eig.mod1\n" in script
+
+            # The script lists the eigenvectors that the job created
+            def out():
+                return subprocess.run(["bash", "r/eigs.cnf1.sh", "out"], check=True,
+                                      stdout=subprocess.PIPE, universal_newlines=True).stdout
+
+            assert out() == ""
+            os.makedirs("d")
+            with open("d/eig.mod1", 'wt') as f:
+                f.write("eig")
+            assert out() == "d/eig.mod1\n"
+
+            # The recommended number of nodes fits the geometry of the job
+            runtimes = {'test': {'eigs e': dict(
+                [(f"a{i}", ["2", 1000]) for i in range(3)] +
+                [(f"b{i}", ["3", 600]) for i in range(3)])}}
+            assert output_eigs_jobs(iter(jobs[0:1]), facility, runtimes) == 1
+            with open("r/eigs.cnf1.sh", 'rt') as f:
+                assert "#SBATCH -t 0:25:00 --nodes=2 -n 4 -J r-eigs.cnf1\n" in f.read()
+
+            # Missing properties are reported with the job
+            try:
+                output_eigs_jobs([{'eig_default_run': "r/x"}], facility)
+                assert False
+            except Exception as e:
+                assert "Missing property" in str(e)
+        finally:
+            os.chdir(cwd)
 
 
 if __name__ == "__main__":
-    process_args()
+    if len(sys.argv) >= 2 and sys.argv[1] == '--test':
+        do_test()
+    else:
+        process_args()
@@ -0,0 +1,54 @@
+#!/bin/bash
+
+# NOTE: style with four spaces indentation and 100 columns
+
+read -r -d '' hlp_msg << 'EOF'
+Stand-in for the globus commandline tool used by the tests of globus_transfer.py. It supports
+`transfer ... --batch -`, `mkdir`, and `task list --filter-task-id <id>...`, and keeps its state
+under GLOBUS_STUB_DIR:
+- calls, a line with the arguments of each call;
+- <task_id>.batch, the input of each transfer;
+- statuses, lines with a task id and its status; other tasks are ACTIVE.
+
+Usage:
+
+  GLOBUS_STUB_DIR=<dir> globus-stub.sh <globus arguments>
+EOF
+
+if [ ${#*} -ge 1 ] && [ ${1} == -h -o ${1} == --help ]; then
+    # Show help
+    echo "${hlp_msg}"
+    exit
+elif [ x${GLOBUS_STUB_DIR}x == xx ]; then
+    echo "globus-stub.sh: error, please set up GLOBUS_STUB_DIR"
+    exit 1
+fi
+
+dir="${GLOBUS_STUB_DIR}"
+echo "$*" >> $dir/calls
+
+case $1 in
+transfer)
+    task_id="task-$(( `ls $dir | grep -c '\.batch$'` + 1 ))"
+    cat > $dir/${task_id}.batch
+    echo "{\"task_id\": \"${task_id}\"}"
+    ;;
+mkdir)
+    ;;
+task)
+    tasks=""
+    while [ ${#*} -gt 0 ]; do
+        if [ $1 == --filter-task-id ]; then
+            status="`awk -v t=$2 '$1 == t {print $2}' $dir/statuses 2> /dev/null | tail -1`"
+            tasks="${tasks:+${tasks}, }{\"task_id\": \"$2\", \"status\": \"${status:-ACTIVE}\"}"
+            shift
+        fi
+        shift
+    done
+    echo "{\"DATA\": [${tasks}]}"
+    ;;
+*)
+    echo "globus-stub.sh: unsupported command $1"
+    exit 1
+    ;;
+esac
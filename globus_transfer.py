@@ -0,0 +1,344 @@
+#!/usr/bin/env python
+"""
+Plan and track Globus transfers between facilities.
+
+The files to transfer are read from the standard input, one path relative to the local cache of
+each facility per line, optionally followed by the size of the file in bytes. Files are grouped by
+destination directory and packed into transfer tasks bounded by number of files and total bytes.
+The tasks submitted are recorded in a single ledger, and all outstanding tasks are polled at once
+with a single call to `globus task list`.
+
+For each file in a submitted task a track file `<file>.globus-to-<destination>` is kept in the
+local cache, which is what `artifacts.json` uses to infer the status of the file.
+"""
+
+import argparse
+import json
+import os
+import shlex
+import subprocess
+import sys
+import tempfile
+import kaon
+
+# Endpoints without an entry in facilities.json
+ENDPOINT_SHORTCUTS = {
+    'jlab': "b0fca1ad-f485-4a00-8fcd-bca0b93a2a1c:~/qcd/cache/isoClover",
+    'frontera': "142d715e-8939-11e9-b807-0a37f382de32:~/work/b6p3",
+    'jz': "dcb5f28c-dadf-11eb-8324-45cc1b8ccd4a:/gpfsdswork/projects/rech/ual/uie52up/ppdfs"
+}
+
+# Globus task states that won't change anymore
+FINAL_STATUSES = ("SUCCEEDED", "FAILED")
+
+# Maximum number of task ids in a single `globus task list` call
+MAX_TASKS_PER_POLL = 1000
+
+
+# Description of the facilities, next to this script
+FACILITIES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "facilities.json")
+
+
+def get_endpoint(name, facilities_file=FACILITIES_FILE):
+    """
+    Return the Globus endpoint and base path for a facility name. The name `here` refers to the
+    facility in the environ variable THIS_FACILITY.
+    """
+
+    if name == "here":
+        if not os.environ.get("THIS_FACILITY"):
+            raise Exception("Please set up the environ variable THIS_FACILITY")
+        name = os.environ["THIS_FACILITY"]
+    facilities_schema = kaon.get_schema_from_json([facilities_file])
+    for entry in kaon.execute_schema(facilities_schema, [{'facility': {name}}], {}):
+        if entry.get('facility') == name and entry.get('globus_endpoint'):
+            return entry['globus_endpoint']
+    if name in ENDPOINT_SHORTCUTS:
+        return ENDPOINT_SHORTCUTS[name]
+    raise Exception(f"The facility `{name}` has no Globus endpoint in `{facilities_file}`")
+
+
+def run_globus(globus, args, input=None):
+    """
+    Run a globus command and return the output parsed as JSON.
+    """
+
+    r = subprocess.run(globus + args + ['--format', 'json'], input=input,
+                       stdout=subprocess.PIPE, universal_newlines=True, check=True)
+    return json.loads(r.stdout)
+
+
+#
+# Ledger
+#
+
+
+def read_ledger(filename):
+    """
+    Return the ledger, a dictionary from task id to the task description.
+    """
+
+    if not os.path.exists(filename):
+        return {}
+    with open(filename, 'rt') as f:
+        return json.load(f)
+
+
+def write_ledger(ledger, filename):
+    """
+    Store the ledger; the file is replaced atomically.
+    """
+
+    with open(f"{filename}.tmp", 'wt') as f:
+        json.dump(ledger, f, indent=4, sort_keys=True)
+    os.replace(f"{filename}.tmp", filename)
+
+
+def poll_tasks(ledger, globus):
+    """
+    Update the status of all unfinished tasks in the ledger with as few calls as possible.
+    """
+
+    task_ids = [task_id for task_id, task in ledger.items()
+                if task['status'] not in FINAL_STATUSES]
+    for i in range(0, len(task_ids), MAX_TASKS_PER_POLL):
+        chunk = task_ids[i:i + MAX_TASKS_PER_POLL]
+        r = run_globus(globus, ['task', 'list', '--limit', str(len(chunk))] +
+                       [arg for task_id in chunk for arg in ('--filter-task-id', task_id)])
+        for task in r.get('DATA', []):
+            if task['task_id'] in ledger:
+                ledger[task['task_id']]['status'] = task['status']
+
+
+def get_track_filename(local_cache, filename, destination_name):
+    """
+    Return the track file for a file being transferred.
+    """
+
+    return os.path.join(local_cache, f"{filename}.globus-to-{destination_name}")
+
+
+def retire_finished_tasks(ledger, local_cache):
+    """
+    Remove from the ledger and the local cache the track of the tasks that finished.
+    """
+
+    for task_id, task in list(ledger.items()):
+        if task['status'] not in FINAL_STATUSES:
+            continue
+        for filename in task['files']:
+            track = get_track_filename(local_cache, filename, task['destination_name'])
+            if os.path.exists(track):
+                os.remove(track)
+        del ledger[task_id]
+
+
+#
+# Planning
+#
+
+
+def plan_batches(files, max_files, max_bytes):
+    """
+    Return a list of batches, each of them a list of files. Files in the same destination
+    directory are put together, and each batch has at most `max_files` files and `max_bytes`
+    bytes, unless a single file is larger than that.
+    """
+
+    by_dir = {}
+    for filename, size in files:
+        by_dir.setdefault(os.path.dirname(filename), []).append((filename, size))
+
+    batches = []
+    batch, batch_bytes = [], 0
+    for dirname in sorted(by_dir.keys()):
+        for filename, size in by_dir[dirname]:
+            if batch and (len(batch) >= max_files or batch_bytes + size > max_bytes):
+                batches.append(batch)
+                batch, batch_bytes = [], 0
+            batch.append(filename)
+            batch_bytes += size
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def read_files(f, origin_name, local_cache):
+    """
+    Return a list of (file, size) from the input lines. The size of local files is taken from the
+    filesystem, and their sidecars with the digest are added.
+    """
+
+    files = []
+    for line in f:
+        line_elems = line.split()
+        if not line_elems:
+            continue
+        filename = line_elems[0]
+        if origin_name == "here":
+            path = os.path.join(local_cache, filename)
+            if not os.path.isfile(path):
+                raise Exception(f"The file {path} does not exists")
+            size = os.path.getsize(path)
+            # Send the reference digest along, see verify_checksums.py
+            if os.path.isfile(path + ".sha256"):
+                files.append((filename + ".sha256", os.path.getsize(path + ".sha256")))
+        else:
+            size = int(line_elems[1]) if len(line_elems) > 1 else 0
+        files.append((filename, size))
+    return files
+
+
+def submit_batches(batches, origin_ep, destination_ep, destination_name, ledger, local_cache,
+                   globus):
+    """
+    Launch a Globus task for each batch and record it in the ledger and the track files.
+    """
+
+    # Create directories in destination, once each
+    for dirname in sorted(set([os.path.dirname(f) for batch in batches for f in batch])):
+        subprocess.run(globus + ['mkdir', f"{destination_ep}/{dirname}"],
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    for batch in batches:
+        r = run_globus(globus, ['transfer', origin_ep, destination_ep, '--batch', '-'],
+                       input="".join([f"{f} {f}\n" for f in batch]))
+        task_id = r['task_id']
+        ledger[task_id] = {
+            'origin': origin_ep,
+            'destination': destination_ep,
+            'destination_name': destination_name,
+            'files': batch,
+            'status': 'ACTIVE'
+        }
+        for filename in batch:
+            track = get_track_filename(local_cache, filename, destination_name)
+            os.makedirs(os.path.dirname(track), exist_ok=True)
+            with open(track, 'wt') as f:
+                f.write(f"{task_id} {origin_ep} {destination_ep}\n")
+
+
+def transfer(files, origin_name, destination_name, ledger, local_cache, globus, max_files,
+             max_bytes, max_tasks):
+    """
+    Poll the outstanding tasks and launch new tasks for the files not being transferred already.
+    Return the number of files that are left for a later call.
+    """
+
+    origin_ep = get_endpoint(origin_name)
+    destination_ep = get_endpoint(destination_name)
+
+    poll_tasks(ledger, globus)
+    retire_finished_tasks(ledger, local_cache)
+
+    # Skip files in flight and limit the number of concurrent tasks between the two endpoints
+    in_flight = set()
+    num_active_tasks = 0
+    for task in ledger.values():
+        if task['destination_name'] == destination_name:
+            in_flight.update(task['files'])
+        if task['origin'] == origin_ep and task['destination'] == destination_ep:
+            num_active_tasks += 1
+    files = [(f, size) for f, size in files if f not in in_flight]
+    batches = plan_batches(files, max_files, max_bytes)
+    num_new_tasks = max(max_tasks - num_active_tasks, 0)
+    submit_batches(batches[:num_new_tasks], origin_ep, destination_ep, destination_name, ledger,
+                   local_cache, globus)
+    return sum([len(batch) for batch in batches[num_new_tasks:]])
+
+
+def process_args():
+    """
+    Parser commandline arguments and do the thing
+    """
+
+    parser = argparse.ArgumentParser(
+        description="Transfer the files given from the standard input between two facilities")
+    parser.add_argument("origin", help="origin facility, `here` for this facility")
+    parser.add_argument("destination", help="destination facility, `here` for this facility")
+    parser.add_argument("--max-files", type=int, default=100,
+                        help="maximum number of files in a single Globus task")
+    parser.add_argument("--max-bytes", type=kaon.parse_size, default="500G",
+                        help="maximum bytes in a single Globus task, eg. 500G")
+    parser.add_argument("--max-tasks", type=int, default=4,
+                        help="maximum number of unfinished Globus tasks between two endpoints")
+    parser.add_argument("--ledger", default=None,
+                        help="file tracking the Globus tasks; by default "
+                        "$LOCAL_CACHE/.globus-ledger.json")
+    parser.add_argument("--globus", default=os.environ.get("GLOBUS", "globus"),
+                        help="globus commandline tool; by default $GLOBUS or globus")
+    args = parser.parse_args()
+
+    local_cache = os.environ.get("LOCAL_CACHE", "cache")
+    ledger_filename = args.ledger or os.path.join(local_cache, ".globus-ledger.json")
+    ledger = read_ledger(ledger_filename)
+    files = read_files(sys.stdin, args.origin, local_cache)
+    try:
+        num_pending = transfer(files, args.origin, args.destination, ledger, local_cache,
+                               shlex.split(args.globus), args.max_files, args.max_bytes,
+                               args.max_tasks)
+    finally:
+        os.makedirs(os.path.dirname(ledger_filename) or ".", exist_ok=True)
+        write_ledger(ledger, ledger_filename)
+    if num_pending > 0:
+        sys.stderr.write(f"{num_pending} file(s) left for later; too many unfinished tasks\n")
+
+
+def do_test():
+    """
+    Minimal tests with a stand-in for the globus tool, see globus-stub.sh.
+    """
+
+    globus = [os.path.join(os.path.dirname(os.path.abspath(__file__)), "globus-stub.sh")]
+    with tempfile.TemporaryDirectory() as tmpdir:
+        local_cache = os.path.join(tmpdir, "cache")
+        ledger_filename = os.path.join(tmpdir, "ledger.json")
+        os.environ['GLOBUS_STUB_DIR'] = tmpdir
+        os.environ['THIS_FACILITY'] = "jz-gpu"
+        for filename in ("d1/a", "d1/a.sha256", "d1/b", "d2/c"):
+            os.makedirs(os.path.join(local_cache, os.path.dirname(filename)), exist_ok=True)
+            with open(os.path.join(local_cache, filename), 'wt') as f:
+                f.write(filename)
+
+        def run(lines, max_tasks):
+            ledger = read_ledger(ledger_filename)
+            files = read_files(lines, "here", local_cache)
+            num_pending = transfer(files, "here", "jlab", ledger, local_cache, globus,
+                                   max_files=2, max_bytes=1000, max_tasks=max_tasks)
+            write_ledger(ledger, ledger_filename)
+            with open(os.path.join(tmpdir, "calls"), 'rt') as f:
+                calls = f.read().splitlines()
+            os.remove(os.path.join(tmpdir, "calls"))
+            return num_pending, ledger, calls
+
+        # The sidecar goes with its file, and only the directory of the submitted batch is made
+        num_pending, ledger, calls = run(["d1/a\n", "d1/b\n", "d2/c\n"], max_tasks=1)
+        assert num_pending == 2
+        assert ledger['task-1']['files'] == ["d1/a.sha256", "d1/a"]
+        assert [c for c in calls if c.startswith("mkdir")] == [
+            f"mkdir {ENDPOINT_SHORTCUTS['jlab']}/d1"]
+        assert os.path.exists(get_track_filename(local_cache, "d1/a", "jlab"))
+
+        # The task in the ledger is polled, and its files aren't sent again
+        num_pending, ledger, calls = run(["d1/a\n", "d1/b\n", "d2/c\n"], max_tasks=1)
+        assert num_pending == 2 and list(ledger.keys()) == ["task-1"]
+        assert calls == ["task list --limit 1 --filter-task-id task-1 --format json"]
+
+        # Finished tasks are retired and the rest of the files are sent
+        with open(os.path.join(tmpdir, "statuses"), 'wt') as f:
+            f.write("task-1 SUCCEEDED\n")
+        num_pending, ledger, calls = run(["d1/b\n", "d2/c\n"], max_tasks=1)
+        assert num_pending == 0 and list(ledger.keys()) == ["task-2"]
+        assert ledger['task-2']['files'] == ["d1/b", "d2/c"]
+        assert [c for c in calls if c.startswith("mkdir")] == [
+            f"mkdir {ENDPOINT_SHORTCUTS['jlab']}/d1", f"mkdir {ENDPOINT_SHORTCUTS['jlab']}/d2"]
+        assert not os.path.exists(get_track_filename(local_cache, "d1/a", "jlab"))
+        with open(os.path.join(tmpdir, "task-2.batch"), 'rt') as f:
+            assert f.read() == "d1/b d1/b\nd2/c d2/c\n"
+
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 2 and sys.argv[1] == '--test':
+        do_test()
+    else:
+        process_args()
@@ -0,0 +1,55 @@
+#!/bin/bash
+
+# NOTE: style with four spaces indentation and 100 columns
+
+read -r -d '' hlp_msg << 'EOF'
+Compact the logs of promises under JLAB_REMOTE_PROMISES_PATH, keeping only the promises that
+haven't expired or been removed. Run it periodically, eg. once a day.
+
+Usage:
+
+  kaon-compact-promises.sh
+EOF
+
+if [ ${#*} -ge 1 ] && [ ${1} == -h -o ${1} == --help ]; then
+    # Show help
+    echo "${hlp_msg}"
+    exit
+elif [ ${#*} != 0 ]; then
+    echo "Invalid number of arguments"
+    echo "${hlp_msg}"
+    exit 1
+fi
+
+if [ x${JLAB_REMOTE_PROMISES_PATH}x == xx ]; then
+    echo "kaon-compact-promises.sh: error, please set up JLAB_REMOTE_PROMISES_PATH"
+    exit 1
+fi
+
+buffer="$(( 60*60*24 ))"
+d="$(( `date +%s` - buffer ))"
+
+# The logs are replaced while holding the lock, so no append is lost, and readers, which take a
+# shared lock, see either all old or all new logs
+${JLAB_REMOTE} bash -s -- ${JLAB_REMOTE_PROMISES_PATH} ${d} << 'EOF'
+cd $1 || exit 0
+exec 9>> .lock && flock 9 || exit 1
+ls *.log > /dev/null 2>&1 || exit 0
+rm -f *.log.compact
+sort -s -k1,1n -k2,2 *.log | awk -v d="$2" '
+    { epoch[$4] = $1; op[$4] = $2; promiser[$4] = $3 }
+    END {
+        for (f in op) {
+            if (op[f] != "add" || epoch[f] < d) continue
+            print epoch[f], "add", promiser[f], f > (promiser[f] ".log.compact")
+        }
+    }'
+for log in *.log ; do
+    if [ -f $log.compact ]; then
+        sort -n -s -k1,1 $log.compact > $log.tmp && mv $log.tmp $log || exit 1
+        rm -f $log.compact
+    else
+        : > $log.tmp && mv $log.tmp $log || exit 1
+    fi
+done
+EOF
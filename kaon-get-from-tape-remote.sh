@@ -7,22 +7,49 @@ Request to bring some files from tape
 
 Usage:
 
-  ... | kaon-get-from-tape-remote.sh
+  ... | kaon-get-from-tape-remote.sh [<max-files>]
 where:
 - ..., the script reads a list of files to bring from standard input.
+- <max-files>, maximum number of files in a single request (default 1000).
+
+The files are requested ordered by tape volume and position in the volume, so that each volume is
+mounted once. The volume and the position are given by the command in TAPE_METADATA_COMMAND
+(default ./kaon-get-tape-metadata.sh); see kaon-get-tape-metadata.sh for the expected output.
+Files in the same volume are kept in the same request, unless they don't fit in a single one.
 EOF
 
 if [ ${#*} -ge 1 ] && [ ${1} == -h -o ${1} == --help ]; then
     # Show help
     echo "${hlp_msg}"
     exit
-elif [ ${#*} != 1 ]; then
+elif [ ${#*} -gt 1 ]; then
     echo "Invalid number of arguments"
     echo "${hlp_msg}"
     exit 1
 fi
 
+max_files="${1:-1000}"
+
 allfiles="`mktemp`"
-for f in `cat`; do echo /cache/isoClover/$f; done > $allfiles
-${JLAB_REMOTE} srmGet `cat $allfiles`
-rm $allfiles
+metadata="`mktemp`"
+batches="`mktemp`"
+awk 'NF {print $1}' > $allfiles
+${TAPE_METADATA_COMMAND:-./kaon-get-tape-metadata.sh} < $allfiles > $metadata
+
+# Sort the files by volume and position; files without metadata go at the end
+awk 'NR == FNR { vol[$1] = $2; pos[$1] = $3; next }
+     { print $1, ($1 in vol ? vol[$1] : "~"), ($1 in pos ? pos[$1] : 0) }' $metadata $allfiles |
+    LC_ALL=C sort -k2,2 -k3,3n > ${batches}.sorted
+
+# Assign a request to each file; start a new request when the next volume doesn't fit
+awk -v max=$max_files '
+    NR == FNR { n[$2]++; next }
+    $2 != vol { vol = $2; if (size > 0 && size + n[vol] > max) { batch++; size = 0 } }
+    size >= max { batch++; size = 0 }
+    { print batch + 0, $1; size++ }' ${batches}.sorted ${batches}.sorted > $batches
+
+for b in `awk '{print $1}' $batches | uniq`; do
+    ${JLAB_REMOTE} srmGet `awk -v b=$b '$1 == b {print "/cache/isoClover/" $2}' $batches`
+done
+
+rm -f $allfiles $metadata $batches ${batches}.sorted
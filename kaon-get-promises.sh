@@ -3,7 +3,9 @@
 # NOTE: style with four spaces indentation and 100 columns
 
 read -r -d '' hlp_msg << 'EOF'
-Get all files being promised and the facility that made the promise
+Get all files being promised and the facility that made the promise. The logs of all facilities
+under JLAB_REMOTE_PROMISES_PATH are read with a single remote call and kept for a while in the
+local cache, see KAON_PROMISES_TTL. A promise expires after 24 hours or when it is removed.
 
 Usage:
 
@@ -11,6 +13,9 @@ Usage:
 
 where:
 - <path> retstrict to find promises withing the paths
+
+Environ variables:
+- KAON_PROMISES_TTL, seconds before reading the logs again; by default 60
 EOF
 
 if [ ${#*} -ge 1 ] && [ ${1} == -h -o ${1} == --help ]; then
@@ -21,15 +26,44 @@ fi
 
 if [ x${JLAB_REMOTE_PROMISES_PATH}x == xx ]; then
     echo "kaon-get-promises.sh: error, please set up JLAB_REMOTE_PROMISES_PATH"
+    exit 1
 fi
 
-work="$1"
-
+now="$(( `date +%s` ))"
 buffer="$(( 60*60*24 ))"
-d="$(( `date +%s` - buffer ))"
-for work in "${*}" ; do
-    ${JLAB_REMOTE} bash -c "[ -d ${JLAB_REMOTE_PROMISES_PATH}/${work} ] && find ${JLAB_REMOTE_PROMISES_PATH}/${work}" | while read file crap ; do
-        IFS="@" read filepath epoch promiser <<< "$file"
-        [ $epoch -ge $d ] && echo $filepath $promiser
-    done
-done
+d="$(( now - buffer ))"
+
+# Read the logs if the local copy is too old; concurrent calls wait for the one reading them
+cache="${LOCAL_CACHE:-cache}/.promises-cache.txt"
+ttl="${KAON_PROMISES_TTL:-60}"
+mkdir -p "`dirname $cache`"
+(
+    flock 9
+    if [ ! -f $cache ] || [ $(( now - `stat -c %Y $cache` )) -ge $ttl ]; then
+        # There are no promises if there are no logs; the logs are read with a shared lock, so
+        # that they aren't read while being appended or compacted
+        remote_cmd="cd ${JLAB_REMOTE_PROMISES_PATH} 2> /dev/null || exit 0"
+        remote_cmd="${remote_cmd}; ls *.log > /dev/null 2>&1 || exit 0"
+        remote_cmd="${remote_cmd}; exec 9>> .lock && flock -s 9 || exit 1; cat *.log"
+        if ! echo "${remote_cmd}" | ${JLAB_REMOTE} bash -s > $cache.tmp ; then
+            echo "kaon-get-promises.sh: error, failed to read the logs of promises"
+            rm -f $cache.tmp
+            exit 1
+        fi
+        mv $cache.tmp $cache
+    fi
+) 9> $cache.lock || exit 1
+
+# Records are `<epoch> <add|rm> <facility> <file>`; the latest record of each file wins, and
+# a removal wins over an addition at the same second
+sort -s -k1,1n -k2,2 $cache | awk -v d="$d" -v paths="$*" '
+    { epoch[$4] = $1; op[$4] = $2; promiser[$4] = $3 }
+    END {
+        n = split(paths, p, " ")
+        for (f in op) {
+            if (op[f] != "add" || epoch[f] < d) continue
+            found = (n == 0)
+            for (i = 1; i <= n && !found; i++) found = (index(f, p[i] "/") == 1)
+            if (found) print f, promiser[f]
+        }
+    }'
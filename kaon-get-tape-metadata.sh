@@ -0,0 +1,51 @@
+#!/bin/bash
+
+# NOTE: style with four spaces indentation and 100 columns
+
+read -r -d '' hlp_msg << 'EOF'
+Print the tape volume and the position in the volume of files in JLab's tape library, as read from
+the stub files in /mss.
+
+Usage:
+
+  ... | kaon-get-tape-metadata.sh
+
+where:
+- ..., the script reads a list of files relative to /mss/lattice/isoClover from standard input.
+
+The output has a line for each file found with the file, the volume, and the position. The script
+can be replaced by setting TAPE_METADATA_COMMAND for kaon-get-from-tape-remote.sh.
+EOF
+
+if [ ${#*} -ge 1 ] && [ ${1} == -h -o ${1} == --help ]; then
+    # Show help
+    echo "${hlp_msg}"
+    exit
+elif [ ${#*} != 0 ]; then
+    echo "Invalid number of arguments"
+    echo "${hlp_msg}"
+    exit 1
+fi
+
+allfiles="`mktemp`"
+awk 'NF {print "/mss/lattice/isoClover/" $1}' > $allfiles
+
+# Get all the stubs' volume and position in a single remote call
+[ -s $allfiles ] && ${JLAB_REMOTE} grep -H -E '^(volser|filePosition)=' `cat $allfiles` | awk '
+    {
+        i = index($0, ":")
+        f = substr($0, 1, i - 1)
+        sub("^/mss/lattice/isoClover/", "", f)
+        split(substr($0, i + 1), kv, "=")
+        v[f, kv[1]] = kv[2]
+        seen[f] = 1
+    }
+    END {
+        for (f in seen) {
+            if ((f, "volser") in v) {
+                print f, v[f, "volser"], ((f, "filePosition") in v ? v[f, "filePosition"] : 0)
+            }
+        }
+    }'
+
+rm -f $allfiles
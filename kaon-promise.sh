@@ -3,11 +3,12 @@
 # NOTE: style with four spaces indentation and 100 columns
 
 read -r -d '' hlp_msg << 'EOF'
-Create promises of things computing in this facility visible to other facilities.
+Create promises of things computing in this facility visible to other facilities. The promises are
+appended to the log of the facility, <tag>.log, under JLAB_REMOTE_PROMISES_PATH.
 
 Usage:
 
-  kaon-promise.sh <tag>
+  ... | kaon-promise.sh <tag>
 
 where:
 - <tag> unique name for this facility
@@ -24,7 +25,8 @@ elif [ ${#*} != 1 ]; then
 fi
 
 if [ x${JLAB_REMOTE_PROMISES_PATH}x == xx ]; then
-    echo "kaon-get-promises.sh: error, please set up JLAB_REMOTE_PROMISES_PATH"
+    echo "kaon-promise.sh: error, please set up JLAB_REMOTE_PROMISES_PATH"
+    exit 1
 fi
 
 tag="$1"
@@ -33,13 +35,18 @@ epoch="$(( `date +%s` ))"
 
 tmpfiles="`mktemp`"
 while read file crap ; do
-    echo "${JLAB_REMOTE_PROMISES_PATH}/${file}@${epoch}@${tag}"
+    echo "${epoch} add ${tag} ${file}"
 done > $tmpfiles
 
-# Make all directories
-${JLAB_REMOTE} mkdir -p `cat $tmpfiles | while read file; do dirname $file; done | sort -u`
-
-# Do the touch
-${JLAB_REMOTE} touch `cat $tmpfiles`
+# Append all records at once while holding the lock of the logs; see kaon-compact-promises.sh
+if [ -s $tmpfiles ]; then
+    {
+        echo "mkdir -p ${JLAB_REMOTE_PROMISES_PATH} || exit 1"
+        echo "exec 9>> ${JLAB_REMOTE_PROMISES_PATH}/.lock && flock 9 || exit 1"
+        echo "cat >> ${JLAB_REMOTE_PROMISES_PATH}/${tag}.log << 'KAON_EOF'"
+        cat $tmpfiles
+        echo "KAON_EOF"
+    } | ${JLAB_REMOTE} bash -s
+fi
 
 rm -f $tmpfiles
@@ -2,35 +2,51 @@
 
 # NOTE: style with four spaces indentation and 100 columns
 
-read -r -d '' hlp_msg << EOF
-Remove promises made by any facility.
+read -r -d '' hlp_msg << 'EOF'
+Remove promises made by any facility. The removals are appended to the log of this facility,
+<tag>.log, under JLAB_REMOTE_PROMISES_PATH.
 
 Usage:
 
-  kaon-rm-promise.sh
-EOF 
+  ... | kaon-rm-promise.sh <tag>
 
-if [ ${1} == -h -o ${1} == --help ]; then
+where:
+- <tag> unique name for this facility
+EOF
+
+if [ ${#*} -ge 1 ] && [ ${1} == -h -o ${1} == --help ]; then
     # Show help
-    echo ${hlp_msg}
+    echo "${hlp_msg}"
     exit
 elif [ ${#*} != 1 ]; then
     echo "Invalid number of arguments"
-    echo ${hlp_msg}
+    echo "${hlp_msg}"
+    exit 1
+fi
+
+if [ x${JLAB_REMOTE_PROMISES_PATH}x == xx ]; then
+    echo "kaon-rm-promise.sh: error, please set up JLAB_REMOTE_PROMISES_PATH"
     exit 1
 fi
 
 tag="$1"
 
 epoch="$(( `date +%s` ))"
-ssh_base="ssh -J login.jlab.org qcdi1402"
 
 tmpfiles="`mktemp`"
 while read file crap ; do
-    echo "/volatile/JLabLQCD/eromero/promises/${file}@*"
+    echo "${epoch} rm ${tag} ${file}"
 done > $tmpfiles
 
-# Remove all the promises
-$ssh_base rm -f `cat $tmpfiles`
+# Append all records at once while holding the lock of the logs; see kaon-compact-promises.sh
+if [ -s $tmpfiles ]; then
+    {
+        echo "mkdir -p ${JLAB_REMOTE_PROMISES_PATH} || exit 1"
+        echo "exec 9>> ${JLAB_REMOTE_PROMISES_PATH}/.lock && flock 9 || exit 1"
+        echo "cat >> ${JLAB_REMOTE_PROMISES_PATH}/${tag}.log << 'KAON_EOF'"
+        cat $tmpfiles
+        echo "KAON_EOF"
+    } | ${JLAB_REMOTE} bash -s
+fi
 
 rm -f $tmpfiles
@@ -12,13 +12,32 @@ introduce, modify, remove dictionary entries.
 import json
 import sys
 import re
+import string
 import itertools
 import argparse
 import subprocess
+import concurrent.futures
+import heapq
+import os
+import tempfile
+import collections.abc
+import time
+import signal
+import sqlite3
+import contextlib
+import io
 
 # Log levels, for now, 0 (no logging) and 1 (some logging)
 LOG_LEVEL = 0
 
+# Whether to print the estimated and the actual number of entries selected by the actions
+EXPLAIN = False
+
+# Statistics of the commands executed by each execute item in the last call to
+# `execute_schema_by_id`: path -> {"latencies": [seconds], "retries": count, "hedges": count,
+# "timeouts": count}
+COMMAND_STATS = {}
+
 #
 # Check schema types
 #
@@ -205,7 +224,12 @@ def check_execute(value, path):
     """
     Check that the input is a dictionary with {
         "command": _property_value_,
-        "return-properties": [ _property_name_ ] }
+        "return-properties": [ _property_name_ ],
+        "split": "JSON string",
+        "timeout": _duration_,
+        "retries": "JSON number",
+        "retry-backoff": _duration_,
+        "hedge-after": _duration_ }
     """
 
     check_list_or_dict(value, path)
@@ -215,24 +239,114 @@ def check_execute(value, path):
     else:
         keywords = {
             'command': check_property_value,
-            'return-properties': check_flat_list
+            'return-properties': check_flat_list,
+            'split': check_string,
+            'timeout': check_duration,
+            'retries': check_count,
+            'retry-backoff': check_duration,
+            'hedge-after': check_duration
         }
         check_dict_with_keywords(value, path, keywords)
 
 
+def check_duration(value, path):
+    """
+    Check that the input is a nonnegative number of seconds or a string like 90s, 30m, or 1h.
+    """
+
+    try:
+        seconds = get_duration(value)
+    except (ValueError, TypeError):
+        seconds = None
+    show_error(seconds is not None and seconds >= 0,
+               "unexpected value, it should be a number of seconds or a string like 30s, 5m, or "
+               "1h", path)
+
+
+def check_count(value, path):
+    """
+    Check that the input is a nonnegative integer.
+    """
+
+    show_error(isinstance(value, int) and not isinstance(value, bool) and value >= 0,
+               "unexpected value, it should be a nonnegative integer", path)
+
+
 def check_show_after(value, path):
     """
     Check that the input is a list of any of the following strings:
-    "select" or "modify" or "execute" or "finalize" or "updated-entries"
+    "select" or "aggregate" or "modify" or "execute" or "finalize" or "updated-entries"
     """
 
     check_list(value, path)
     for i, v in enumerate(value):
-        show_error(v in ("select", "modify", "execute", "finalize", "updated-entries"),
-                   'expected either "select" or "modify" or "execute" or "finalize" or "updated-entries"',
+        show_error(v in ("select", "aggregate", "modify", "execute", "finalize",
+                         "updated-entries"),
+                   'expected either "select" or "aggregate" or "modify" or "execute" or '
+                   '"finalize" or "updated-entries"',
                    f"{path}/[i]")
 
 
+def check_aggregate(value, path):
+    """
+    Check that the input is a dictionary from property name to an aggregate function, one of
+    "count", "distinct:_property_name_", "min:_property_name_", or "max:_property_name_".
+    """
+
+    check_dict(value, path)
+    for k, v in value.items():
+        check_string(v, f"{path}/{k}")
+        try:
+            parse_aggregate_function(v)
+        except ValueError as e:
+            show_error(False, str(e), f"{path}/{k}")
+
+
+def check_classify(value, path):
+    """
+    Check that the input is a list of dictionaries with {
+        /*optional*/ "name": "JSON string",
+        "select": _entry_constrains_,
+        /*optional*/ "finalize": [ _modify_item_ ] or _modify_item_,
+        "id": "JSON string" }
+    where all `select` have "matching-re" on the same property and on no other.
+    """
+
+    check_list(value, path)
+    show_error(len(value) > 0, "expected at least one element", path)
+    keywords = {
+        'name': check_string,
+        'select': check_property_constrains,
+        'finalize': check_modify,
+        'id': check_string
+    }
+    classify_props = set()
+    for i, v in enumerate(value):
+        check_dict_with_keywords(v, f"{path}/[{i}]", keywords)
+        show_error('select' in v and 'id' in v, 'expected "select" and "id"', f"{path}/[{i}]")
+        props = [k for k, c in v['select'].items() if isinstance(c, dict) and 'matching-re' in c]
+        show_error(len(props) == 1, 'expected "matching-re" on a single property',
+                   f"{path}/[{i}]/select")
+        show_error('interpolate' not in v['select'][props[0]],
+                   'unexpected "interpolate" on the property with "matching-re"',
+                   f"{path}/[{i}]/select/{props[0]}")
+        classify_props.add(props[0])
+    show_error(len(classify_props) == 1,
+               'expected "matching-re" on the same property in all elements', path)
+
+
+def check_entries_by_id(value, path):
+    """
+    Check that the input is a dictionary from id to a dictionary of property names and strings.
+    """
+
+    check_dict(value, path)
+    for id, entry in value.items():
+        check_dict(entry, f"{path}/{id}")
+        for k, v in entry.items():
+            check_string(v, f"{path}/{id}/{k}")
+
+
 def check_schema(value):
     """
     Check that the input is a list of dictionaries satisfying the scheme.
@@ -246,12 +360,23 @@ def check_schema(value):
         'modify': check_modify,
         'execute': check_execute,
         'finalize': check_modify,
+        'classify': check_classify,
+        'shard-by': check_string,
+        'group-by': check_flat_list,
+        'aggregate': check_aggregate,
+        'entries': check_entries_by_id,
         'show-after': check_show_after,
         'id': check_string
     }
     for i, v in enumerate(value):
         action_name = f"[name='{v['name']}']" if isinstance(v, dict) and 'name' in v else f"[{i}]"
         check_dict_with_keywords(v, action_name, keywords)
+        for k in ('classify', 'entries'):
+            if k in v:
+                show_error(all([k not in v for k in ('select', 'modify', 'execute', 'finalize',
+                                                      'id')]),
+                           'unexpected "select", "modify", "execute", "finalize", or "id" together '
+                           f'with "{k}"', action_name)
 
 
 def check_constrain_item(value, path):
@@ -290,7 +415,7 @@ def print_entries_for_debugging(entries, action, step):
 
     header = f"Entries after applying `{step}`" if step != "updated-entries" else "Updated entries"
     sys.stderr.write(f"> {header}\n")
-    json.dump(entries, sys.stderr, indent=4, sort_keys=True)
+    json.dump(list(entries), sys.stderr, indent=4, sort_keys=True)
     sys.stderr.write("\n")
 
 
@@ -314,55 +439,13 @@ def get_property_value(value):
     return [get_property_value(v) for v in value]
 
 
-def execute_schema(schema, constrained_view, env):
+def execute_schema(schema, constrained_view, env, jobs=1, memory_budget=None):
     """
-    Execute each of the actions in the schema in the same order as given.
+    Execute each of the actions in the schema in the same order as given and return the entries
+    satisfying the constrains.
     """
 
-    entries = {}
-    for i, action in enumerate(schema):
-        action_name = action.get('name', f"[{i}]")
-        if LOG_LEVEL > 0:
-            sys.stderr.write(f"Running action `{action_name}`\n")
-
-        if 'select' in action:
-            active_entries = select_entries(entries.values(), action['select'], env)
-        else:
-            active_entries = [{}]
-        print_entries_for_debugging(active_entries, action, 'select')
-
-        active_entries = [
-            new_entry for modify_item in make_a_list(action.get('modify', [{}]))
-            for entry in active_entries for new_entry in modify_entry(entry, modify_item)]
-        print_entries_for_debugging(active_entries, action, 'modify')
-
-        for j, execute_item in enumerate(make_a_list(action.get('execute', []))):
-            try:
-                active_entries = execute_entries(active_entries, execute_item, env)
-            except Exeception as e:
-                raise Exception(f"Error in {action_name}/execute/[j].") from e
-        print_entries_for_debugging(active_entries, action, 'execute')
-
-        active_entries = [
-            new_entry for modify_item in make_a_list(action.get('finalize', [{}]))
-            for entry in active_entries for new_entry in modify_entry(entry, modify_item)]
-        print_entries_for_debugging(active_entries, action, 'finalize')
-
-        updated_entries = set()
-        for entry in active_entries if 'id' in action else []:
-            try:
-                id = action['id'].format(
-                    **dict_with_defaults(apply_at_defaults_on_entry(entry), env))
-            except KeyError as e:
-                raise Exception(
-                    f"Error interpolating the id in action with name `{action_name}` for entry {entry}.") from e
-            entries[id] = apply_at_defaults_on_entry(
-                dict_with_defaults(entry, entries[id]) if id in entries else entry)
-            updated_entries.add(id)
-        if 'updated-entries' in action.get('show-after', []):
-            print_entries_for_debugging(
-                [entry for id, entry in entries.items() if id in updated_entries], action,
-                'updated-entries')
+    entries = execute_schema_by_id(schema, env, jobs=jobs, memory_budget=memory_budget)
 
     # Apply the constrains
     entries = [entry for entry in entries.values()
@@ -370,6 +453,567 @@ def execute_schema(schema, constrained_view, env):
     return entries
 
 
+def execute_schema_by_id(schema, env, jobs=1, memory_budget=None, store=None):
+    """
+    Execute each of the actions in the schema in the same order as given and return a mapping from
+    id to entry, which is `store` if given or a new `EntryStore`. Actions with "shard-by" are
+    executed with up to `jobs` processes.
+
+    The entries flow from one stage of the action to the next one as they are produced, and they
+    are only collected into a list when a stage needs to go over them several times or they are
+    printed with "show-after". If `memory_budget` is given, the collected entries exceeding that
+    many bytes are stored in temporary files.
+
+    The statistics of the commands from previous calls are dropped from COMMAND_STATS, so that
+    they don't grow when the schema is executed repeatedly, eg. with --watch.
+    """
+
+    COMMAND_STATS.clear()
+    entries = store if store is not None else EntryStore()
+    pool = None
+    try:
+        for i, action in enumerate(schema):
+            action_name = action.get('name', f"[{i}]")
+            if LOG_LEVEL > 0:
+                sys.stderr.write(f"Running action `{action_name}`\n")
+
+            if 'classify' in action:
+                updated_entries = execute_classify(entries, action, action_name, env, memory_budget)
+            elif 'entries' in action:
+                for id, entry in action['entries'].items():
+                    entries[id] = update_entry(entries.get(id), entry)
+                updated_entries = set(action['entries'].keys())
+            else:
+                # The stages are chained lazily; the selection is done over a copy of the list of
+                # entries because the entries are updated while the stages are still going
+                if 'select' in action:
+                    if EXPLAIN:
+                        sys.stderr.write(f"Plan for action `{action_name}`:\n")
+                    active_entries = select_entries(entries, action['select'], env,
+                                                    memory_budget=memory_budget)
+                else:
+                    active_entries = [{}]
+                active_entries = show_entries_after(active_entries, action, 'select', memory_budget)
+
+                if 'group-by' in action or 'aggregate' in action:
+                    active_entries = aggregate_entries(active_entries, action.get('group-by', []),
+                                                       action.get('aggregate', {'count': 'count'}))
+                    active_entries = show_entries_after(active_entries, action, 'aggregate',
+                                                        memory_budget)
+
+                if jobs > 1 and 'shard-by' in action:
+                    active_entries = collect_entries(active_entries, memory_budget)
+                if jobs > 1 and is_action_shardable(action, active_entries):
+                    if pool is None:
+                        pool = concurrent.futures.ProcessPoolExecutor(max_workers=jobs)
+                    active_entries = execute_sharded_action(active_entries, action, action_name,
+                                                            env, pool)
+                else:
+                    active_entries = modify_entries(active_entries, action.get('modify', [{}]),
+                                                    memory_budget)
+                    active_entries = show_entries_after(active_entries, action, 'modify',
+                                                        memory_budget)
+
+                    for j, execute_item in enumerate(make_a_list(action.get('execute', []))):
+                        active_entries = execute_entries_in_action(
+                            active_entries, execute_item, env, f"{action_name}/execute/[{j}]")
+                    active_entries = show_entries_after(active_entries, action, 'execute',
+                                                        memory_budget)
+
+                    active_entries = modify_entries(active_entries, action.get('finalize', [{}]),
+                                                    memory_budget)
+                active_entries = show_entries_after(active_entries, action, 'finalize',
+                                                    memory_budget)
+
+                if 'id' in action:
+                    updated_entries = update_entries(entries, active_entries, action['id'],
+                                                     action_name, env)
+                else:
+                    # Execute the commands anyway
+                    for _ in active_entries:
+                        pass
+                    updated_entries = set()
+            if 'updated-entries' in action.get('show-after', []):
+                print_entries_for_debugging(
+                    [entry for id, entry in entries.items() if id in updated_entries], action,
+                    'updated-entries')
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    entries.commit()
+
+    return entries
+
+
+def show_entries_after(entries, action, step, memory_budget):
+    """
+    Print the entries if the action requests it after the step, and return them. The entries are
+    collected in a list only if printed.
+    """
+
+    if step not in action.get('show-after', []):
+        return entries
+    entries = collect_entries(entries, memory_budget)
+    print_entries_for_debugging(entries, action, step)
+    return entries
+
+
+def execute_entries_in_action(entries, execute_item, env, path):
+    """
+    Return `execute_entries`, adding the path of the execute item to the errors.
+    """
+
+    try:
+        yield from execute_entries(entries, execute_item, env, path)
+    except Exception as e:
+        raise Exception(f"Error in {path}.") from e
+
+
+def is_action_shardable(action, active_entries):
+    """
+    Return whether the action has "shard-by" and the active entries have several shards. Actions
+    showing the entries after "modify" or "execute" aren't sharded.
+    """
+
+    if 'shard-by' not in action or len(active_entries) < 2:
+        return False
+    if any([step in action.get('show-after', []) for step in ('modify', 'execute')]):
+        return False
+    shard_by = action['shard-by']
+    return len(set([entry.get(shard_by) for entry in active_entries])) > 1
+
+
+def execute_sharded_action(active_entries, action, action_name, env, pool):
+    """
+    Apply modify, execute, and finalize of the action on each group of active entries with the same
+    value of the "shard-by" property in a separate process. Return the entries in the same order
+    as if the action were executed without sharding.
+    """
+
+    shards = {}  # shard-by value -> [(sort key, entry)]
+    for j, entry in enumerate(active_entries):
+        shards.setdefault(entry.get(action['shard-by']), []).append(((j,), entry))
+    futures = [pool.submit(execute_action_shard, keyed_entries, action, action_name, env)
+               for keyed_entries in shards.values()]
+    results = []
+    for f in futures:
+        keyed_entries, command_stats = f.result()
+        results.append(keyed_entries)
+        merge_command_stats(command_stats)
+    return (entry for _, entry in heapq.merge(*results, key=lambda keyed_entry: keyed_entry[0]))
+
+
+def execute_action_shard(keyed_entries, action, action_name, env):
+    """
+    Apply modify, execute, and finalize of the action on entries tagged with a sort key. Return the
+    resulting entries tagged with keys that sort them as the execution on all entries would, and
+    the statistics of the executed commands.
+    """
+
+    # The process may have executed other shards before
+    COMMAND_STATS.clear()
+
+    keyed_entries = modify_keyed_entries(keyed_entries, action.get('modify', [{}]))
+    for j, execute_item in enumerate(make_a_list(action.get('execute', []))):
+        path = f"{action_name}/execute/[{j}]"
+        try:
+            keyed_entries = [((key, k), new_entry) for key, entry in keyed_entries
+                             for k, new_entry in enumerate(execute_entries([entry], execute_item,
+                                                                           env, path))]
+        except Exception as e:
+            raise Exception(f"Error in {path}.") from e
+    return modify_keyed_entries(keyed_entries, action.get('finalize', [{}])), COMMAND_STATS
+
+
+def modify_keyed_entries(keyed_entries, modify_items):
+    """
+    Apply `modify_entries` on entries tagged with a sort key.
+    """
+
+    return [((i, key, k), new_entry) for i, modify_item in enumerate(make_a_list(modify_items))
+            for key, entry in keyed_entries
+            for k, new_entry in enumerate(modify_entry(entry, modify_item))]
+
+
+def execute_classify(entries, action, action_name, env, memory_budget):
+    """
+    Execute an action with "classify" and return the ids of the updated entries.
+    """
+
+    classified_entries = classify_entries(entries.values(), action['classify'], env)
+    print_entries_for_debugging([entry for active_entries in classified_entries
+                                 for entry in active_entries], action, 'select')
+
+    updated_entries = set()
+    for j, (item, active_entries) in enumerate(zip(action['classify'], classified_entries)):
+        active_entries = modify_entries(active_entries, item.get('finalize', [{}]), memory_budget)
+        active_entries = show_entries_after(active_entries, action, 'finalize', memory_budget)
+        updated_entries.update(update_entries(
+            entries, active_entries, item['id'], item.get('name', f"{action_name}/classify/[{j}]"),
+            env))
+    return updated_entries
+
+
+def update_entries(entries, active_entries, id_template, action_name, env):
+    """
+    Insert the active entries into `entries` or update the properties of the entries with the same
+    id. Return the ids of the updated entries.
+    """
+
+    updated_entries = set()
+    for entry in active_entries:
+        try:
+            id = id_template.format(**dict_with_defaults(apply_at_defaults_on_entry(entry), env))
+        except KeyError as e:
+            raise Exception(
+                f"Error interpolating the id in action with name `{action_name}` for entry {entry}.") from e
+        entries[id] = update_entry(entries.get(id), entry)
+        updated_entries.add(id)
+    return updated_entries
+
+
+def update_entry(old_entry, entry):
+    """
+    Return the entry stored after inserting `entry` with the same id as `old_entry`, which is None
+    if there was no entry with that id.
+    """
+
+    return apply_at_defaults_on_entry(
+        dict_with_defaults(entry, old_entry) if old_entry is not None else entry)
+
+
+class EntryStore(collections.abc.MutableMapping):
+    """
+    Dictionary from id to entry that keeps how many entries have each property and each value of
+    a property. The counts are used to estimate the number of entries that a select returns.
+    """
+
+    def __init__(self):
+        self.by_id = {}
+        self.property_counts = {}  # property -> number of entries with the property
+        self.value_counts = {}  # property -> value -> number of entries with that value
+
+    def __getitem__(self, id):
+        return self.by_id[id]
+
+    def __setitem__(self, id, entry):
+        if id in self.by_id:
+            self.count(self.by_id[id], -1)
+        self.by_id[id] = entry
+        self.count(entry, 1)
+
+    def __delitem__(self, id):
+        self.count(self.by_id.pop(id), -1)
+
+    def __iter__(self):
+        return iter(self.by_id)
+
+    def __len__(self):
+        return len(self.by_id)
+
+    def count(self, entry, inc):
+        """
+        Add `inc` to the counts of the properties and the values of the entry.
+        """
+
+        for prop, value in entry.items():
+            self.property_counts[prop] = self.property_counts.get(prop, 0) + inc
+            if isinstance(value, (str, int, float)):
+                counts = self.value_counts.setdefault(prop, {})
+                counts[value] = counts.get(value, 0) + inc
+                if counts[value] == 0:
+                    del counts[value]
+
+    def get_property_count(self, prop):
+        """
+        Return the number of entries with the property.
+        """
+
+        return self.property_counts.get(prop, 0)
+
+    def get_value_count(self, prop, value):
+        """
+        Return the number of entries with that value for the property.
+        """
+
+        return self.value_counts.get(prop, {}).get(value, 0)
+
+    def get_candidates(self, select_item):
+        """
+        Return a list with the entries that may pass the select. The list is a copy, so the store
+        can be updated while going over it.
+        """
+
+        return list(self.by_id.values())
+
+    def get_items_in_view(self, constrained_view):
+        """
+        Return a list of (id, entry) with the entries satisfying any of the views.
+        """
+
+        return [(id, entry) for id, entry in self.by_id.items()
+                if is_entry_in_constrained_view(entry, constrained_view)]
+
+    def commit(self):
+        """
+        Make the changes persistent, if the store supports it.
+        """
+
+        pass
+
+    def close(self):
+        """
+        Release the resources of the store, if any.
+        """
+
+        pass
+
+    def estimate_selectivity(self, prop, prop_constrains):
+        """
+        Return the estimated fraction of entries passing the constrains on the property.
+        """
+
+        num_entries = len(self)
+        if num_entries == 0:
+            return 0
+        restriction, values = get_property_restriction(prop_constrains)
+        if restriction == 'values':
+            return sum([self.get_value_count(prop, v) for v in values]) / num_entries
+        if restriction == 'present':
+            return self.get_property_count(prop) / num_entries
+        if restriction == 'absent':
+            return 1 - self.get_property_count(prop) / num_entries
+        return 1
+
+    def estimate(self, select_item):
+        """
+        Return the estimated number of entries passing the select, assuming the constrains on
+        different properties are independent, and that a joint returns at most as many entries as
+        the smallest of its branches. A select is estimated as empty only if some constrain matches
+        no entry.
+        """
+
+        if isinstance(select_item, dict):
+            r = float(len(self))
+            for prop, prop_constrains in select_item.items():
+                r *= self.estimate_selectivity(prop, prop_constrains)
+            return max(int(round(r)), 1) if r > 0 else 0
+        estimates = [self.estimate(item) for item in select_item[1:]]
+        if select_item[0] == "joint":
+            return min(estimates) if estimates else 0
+        return sum(estimates)
+
+
+class SqliteEntryStore(EntryStore):
+    """
+    Entry store kept in a SQLite database, with a row for each property of each entry and an
+    index on property and value. The entries keep the order in which they were inserted, as in
+    `EntryStore`. The changes are visible to other processes after calling `commit`.
+    """
+
+    def __init__(self, filename, clear=True):
+        self.filename = filename
+        self.num_value_sets = 0
+        self.db = sqlite3.connect(filename)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS entries (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT, id TEXT UNIQUE NOT NULL)""")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS properties (
+            seq INTEGER NOT NULL, pos INTEGER NOT NULL, prop TEXT NOT NULL, value,
+            PRIMARY KEY (seq, pos))""")
+        self.db.execute("""CREATE INDEX IF NOT EXISTS properties_by_value
+            ON properties (prop, value, seq)""")
+        self.db.commit()
+        if clear:
+            # Removed when committing, so the previous content is kept if the execution fails
+            self.db.execute("DELETE FROM properties")
+            self.db.execute("DELETE FROM entries")
+
+    def get_seq(self, id):
+        row = self.db.execute("SELECT seq FROM entries WHERE id = ?", (id,)).fetchone()
+        return row[0] if row is not None else None
+
+    def __getitem__(self, id):
+        seq = self.get_seq(id)
+        if seq is None:
+            raise KeyError(id)
+        return {prop: value for prop, value in self.db.execute(
+            "SELECT prop, value FROM properties WHERE seq = ? ORDER BY pos", (seq,))}
+
+    def __setitem__(self, id, entry):
+        seq = self.get_seq(id)
+        if seq is None:
+            seq = self.db.execute("INSERT INTO entries (id) VALUES (?)", (id,)).lastrowid
+        else:
+            self.db.execute("DELETE FROM properties WHERE seq = ?", (seq,))
+        self.db.executemany("INSERT INTO properties VALUES (?, ?, ?, ?)",
+                            [(seq, pos, prop, value)
+                             for pos, (prop, value) in enumerate(entry.items())])
+
+    def __delitem__(self, id):
+        seq = self.get_seq(id)
+        if seq is None:
+            raise KeyError(id)
+        self.db.execute("DELETE FROM properties WHERE seq = ?", (seq,))
+        self.db.execute("DELETE FROM entries WHERE seq = ?", (seq,))
+
+    def __iter__(self):
+        return iter([id for id, in self.db.execute("SELECT id FROM entries ORDER BY seq")])
+
+    def __len__(self):
+        return self.db.execute("SELECT count(*) FROM entries").fetchone()[0]
+
+    def items(self):
+        return self.get_items_where("1", [])
+
+    def values(self):
+        return [entry for _, entry in self.items()]
+
+    def get_items_where(self, condition, params):
+        """
+        Return a list of (id, entry) with the entries satisfying the SQL condition on `e.seq`.
+        """
+
+        rows = self.db.execute(f"""SELECT e.seq, e.id, p.prop, p.value
+            FROM entries AS e LEFT JOIN properties AS p ON p.seq = e.seq
+            WHERE {condition} ORDER BY e.seq, p.pos""", params)
+        items = [(id, {prop: value for _, _, prop, value in props if prop is not None})
+                 for (_, id), props in itertools.groupby(rows, key=lambda row: row[0:2])]
+        if self.num_value_sets > 0:
+            # The sets of values are only used by this query
+            self.db.execute("DELETE FROM temp.value_sets")
+            self.num_value_sets = 0
+        return items
+
+    def get_property_count(self, prop):
+        return self.db.execute("SELECT count(*) FROM properties WHERE prop = ?",
+                               (prop,)).fetchone()[0]
+
+    def get_value_count(self, prop, value):
+        if not is_sql_value(value):
+            return 0
+        return self.db.execute("SELECT count(*) FROM properties WHERE prop = ? AND value = ?",
+                               (prop, value)).fetchone()[0]
+
+    def get_candidates(self, select_item):
+        """
+        Return a list with the entries that may pass the select, using the indices for the
+        constrains on the values of the properties.
+        """
+
+        if not isinstance(select_item, dict):
+            return self.values()
+        conditions, params = [], []
+        for prop, prop_constrains in select_item.items():
+            restriction, values = get_property_restriction(prop_constrains)
+            if restriction == 'values' and all([is_sql_value(v) for v in values]):
+                params.append(prop)
+                conditions.append("e.seq IN (SELECT seq FROM properties WHERE prop = ? AND "
+                                  f"value IN {self.get_value_set(values, params)})")
+            elif restriction in ('present', 'absent'):
+                conditions.append(f"e.seq {'NOT ' if restriction == 'absent' else ''}IN "
+                                  "(SELECT seq FROM properties WHERE prop = ?)")
+                params.append(prop)
+        return [entry for _, entry in self.get_items_where(" AND ".join(conditions) or "1",
+                                                           params)]
+
+    def get_items_in_view(self, constrained_view):
+        if any([not is_sql_value(v) for view in constrained_view for values in view.values()
+                for v in values]):
+            return super().get_items_in_view(constrained_view)
+        view_conditions, params = [], []
+        for view in constrained_view:
+            conditions = []
+            for prop, values in view.items():
+                params.append(prop)
+                conditions.append(
+                    "e.seq NOT IN (SELECT seq FROM properties WHERE prop = ? AND "
+                    f"(value IS NULL OR value NOT IN {self.get_value_set(values, params)}))")
+            view_conditions.append(f"({' AND '.join(conditions) or '1'})")
+        return self.get_items_where(" OR ".join(view_conditions) or "0", params)
+
+    def get_value_set(self, values, params):
+        """
+        Return an SQL expression with the set of values and append its parameters. Large sets are
+        stored in a temporary table, because SQLite limits the number of parameters in a query,
+        to 999 before version 3.32.
+        """
+
+        values = list(values)
+        if len(values) <= MAX_SQL_VALUES_IN_QUERY:
+            params.extend(values)
+            return f"({', '.join(['?'] * len(values))})"
+        self.db.execute("CREATE TEMP TABLE IF NOT EXISTS value_sets (k INTEGER, value)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS temp.value_sets_by_k ON value_sets (k, value)")
+        k = self.num_value_sets
+        self.num_value_sets += 1
+        self.db.executemany("INSERT INTO temp.value_sets VALUES (?, ?)", [(k, v) for v in values])
+        params.append(k)
+        return "(SELECT value FROM temp.value_sets WHERE k = ?)"
+
+    def commit(self):
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+
+# Maximum number of values of a set given as parameters of a SQL query; see `get_value_set`
+MAX_SQL_VALUES_IN_QUERY = 32
+
+
+def is_sql_value(value):
+    """
+    Return whether the value is stored as is in SQLite.
+    """
+
+    return isinstance(value, (str, int, float)) and not isinstance(value, bool)
+
+
+def get_property_restriction(prop_constrains):
+    """
+    Return how the constrains on a property restrict the entries before the selection: a pair
+    ('values', list of possible values), ('present', None), ('absent', None), or ('any', None).
+    """
+
+    if is_property_value(prop_constrains):
+        return 'values', [get_property_value(prop_constrains)]
+    if isinstance(prop_constrains, list):
+        return 'values', [get_property_value(v) for v in prop_constrains]
+    if not prop_constrains:
+        return 'present', None
+    if 'in' in prop_constrains and prop_constrains['in'] is not None:
+        if len(prop_constrains['in']) == 0:
+            return 'absent', None
+        return 'values', list(prop_constrains['in'])
+    if "interpolate" in prop_constrains:
+        # The property may not be in the entry before the selection
+        return 'any', None
+    return 'present', None
+
+
+def parse_store_spec(store_spec):
+    """
+    Return the kind of store and the filename from strings like `memory` or `sqlite:<filename>`.
+    """
+
+    if store_spec == "memory":
+        return "memory", None
+    if store_spec.startswith("sqlite:") and len(store_spec) > len("sqlite:"):
+        return "sqlite", store_spec[len("sqlite:"):]
+    raise ValueError(f"Invalid store `{store_spec}`; expected `memory` or `sqlite:<filename>`")
+
+
+def get_store(store_spec, clear=True):
+    """
+    Return the entry store described by `memory` or `sqlite:<filename>`.
+    """
+
+    kind, filename = parse_store_spec(store_spec)
+    if kind == "memory":
+        return EntryStore()
+    return SqliteEntryStore(filename, clear=clear)
+
+
 def apply_defaults(artifacts, defaults):
     """
     Set missing attributes.
@@ -431,16 +1075,149 @@ def apply_at_defaults_on_entry(entry):
     return new_entry
 
 
-def select_entries(entries, select_item, env):
+def select_entries(entries, select_item, env, path="select", memory_budget=None):
     """
-    Return entries that passes the select specification.
+    Return entries that passes the select specification. If `entries` is an `EntryStore`, the
+    branches of a joint are evaluated from the one with fewer estimated entries; evaluating the
+    rest is skipped if a branch is empty. The values of the join properties in the first branch
+    restrict the selects of the remaining ones, see `get_joint_keys`. The branches of a joint are
+    collected with `collect_entries`.
+    """
+
+    if EXPLAIN and path == "select":
+        return explain_rows(select_entries_in_store(entries, select_item, env, path,
+                                                    memory_budget),
+                            path, estimate_entries(entries, select_item))
+    return select_entries_in_store(entries, select_item, env, path, memory_budget)
+
+
+def select_entries_in_store(entries, select_item, env, path, memory_budget=None):
+    """
+    Return `select_entries` without explaining the whole selection.
     """
 
     if isinstance(select_item, dict):
-        return get_entries_with_property_constrain(entries, select_item, env)
+        candidates = entries.get_candidates(select_item) if isinstance(entries, EntryStore) \
+            else entries
+        return get_entries_with_property_constrain(candidates, select_item, env)
+
+    if select_item[0] == "joint":
+        order = sorted(range(len(select_item) - 1),
+                       key=lambda j: estimate_entries(entries, select_item[j + 1]))
+        entries_list = [[] for _ in order]
+        keys = {}
+        for j in order:
+            item = restrict_select_to_keys(select_item[j + 1], keys)
+            if EXPLAIN and item is not select_item[j + 1]:
+                sys.stderr.write(f"  {path}/[{j + 1}]: semi-join on "
+                                 f"{', '.join([f'{k} ({len(v)} values)' for k, v in keys.items()])}"
+                                 f" from {path}/[{order[0] + 1}]\n")
+            entries_list[j] = collect_entries(select_entries(entries, item, env,
+                                                             f"{path}/[{j + 1}]", memory_budget),
+                                              memory_budget)
+            if EXPLAIN:
+                sys.stderr.write(f"  {path}/[{j + 1}]: estimated "
+                                 f"{estimate_entries(entries, item)} rows, "
+                                 f"actual {len(entries_list[j])} rows\n")
+            if j == order[0]:
+                keys = get_joint_keys(entries_list[j], select_item[1:])
+            if len(entries_list[j]) == 0:
+                if EXPLAIN:
+                    sys.stderr.write(f"  {path}: skipped the remaining branches\n")
+                return []
+        return joint_entries_list(entries_list)
+    return add_entries_list([select_entries(entries, item, env, f"{path}/[{j + 1}]",
+                                            memory_budget)
+                             for j, item in enumerate(select_item[1:])])
+
+
+def get_joint_keys(entries, select_items):
+    """
+    Return a dictionary from property to the set of values that the property takes in the
+    entries, for the properties that every select of a joint constrains without renaming them.
+    Those properties are in all entries of the joint, so only entries with these values can be
+    joined with the given entries.
+    """
+
+    if not all([isinstance(item, dict) for item in select_items]):
+        return {}
+    props = [prop for prop in select_items[0]
+             if all([is_joint_key_in_select(item, prop) for item in select_items])]
+    keys = {}
+    for prop in props:
+        values = set()
+        for entry in entries:
+            if not isinstance(entry.get(prop), str):
+                break
+            values.add(entry[prop])
+        else:
+            keys[prop] = values
+    return keys
+
+
+def is_joint_key_in_select(select_item, prop):
+    """
+    Return whether the select keeps the property of the entries only if it has some values, and
+    doesn't change the property.
+    """
+
+    if prop not in select_item:
+        return False
+    prop_constrains = select_item[prop]
+    if isinstance(prop_constrains, dict) and not set(prop_constrains.keys()) <= {'in', 'copy-to'}:
+        return False
+    if get_property_restriction(prop_constrains)[0] not in ('values', 'present'):
+        return False
+    for c in select_item.values():
+        if isinstance(c, dict) and ('matching-re' in c or prop in (c.get('copy-to'),
+                                                                    c.get('move-to'))):
+            return False
+    return True
 
-    entries_list = [select_entries(entries, item, env) for item in select_item[1:]]
-    return joint_entries_list(entries_list) if select_item[0] == "joint" else add_entries_list(entries_list)
+
+def restrict_select_to_keys(select_item, keys):
+    """
+    Return the select with the values of the properties in `keys` restricted to the given ones,
+    or the same select if no property is restricted.
+    """
+
+    if not keys or not isinstance(select_item, dict):
+        return select_item
+    new_select_item = dict(select_item)
+    for prop, values in keys.items():
+        restriction, prop_values = get_property_restriction(select_item[prop])
+        new_values = sorted(values if restriction == 'present' else
+                            [v for v in prop_values if v in values])
+        # An empty "in" means that the property is absent, so an empty list is used instead
+        if isinstance(select_item[prop], dict) and new_values:
+            new_select_item[prop] = dict(select_item[prop], **{'in': new_values})
+        else:
+            new_select_item[prop] = new_values
+    return new_select_item
+
+
+def estimate_entries(entries, select_item):
+    """
+    Return the estimated number of entries passing the select, or the number of entries if there
+    are no statistics.
+    """
+
+    if isinstance(entries, EntryStore):
+        return entries.estimate(select_item)
+    return len(entries)
+
+
+def explain_rows(entries, path, estimated):
+    """
+    Return the entries, and print the estimated and the actual number of entries after going over
+    all of them.
+    """
+
+    num_entries = 0
+    for entry in entries:
+        num_entries += 1
+        yield entry
+    sys.stderr.write(f"  {path}: estimated {estimated} rows, actual {num_entries} rows\n")
 
 
 def get_entry_after_property_constrains(entry, entry_constrains, env):
@@ -511,58 +1288,387 @@ def get_entry_after_property_constrains(entry, entry_constrains, env):
 
 def add_entries_list(entries_list):
     """
-    Add all entries into a single list.
+    Return an iterator over the entries of all lists.
     """
 
-    return [entry for entries in entries_list for entry in entries]
+    return itertools.chain(*entries_list)
 
 
 def joint_entries_list(entries_list):
     """
-    Joint entries from all lists without conflicting values for the shared properties.
+    Return an iterator over the joint entries from all lists without conflicting values for the
+    shared properties.
     """
 
+    if any([len(entries) == 0 for entries in entries_list]):
+        return
+
     # Find the common attributes to all entries
     common_properties = list(set.intersection(
         *[set(entry.keys()) for entries in entries_list for entry in entries]))
 
     # Trivial case: if there's no common property just do the Cartesian product of the lists
     if len(common_properties) == 0:
-        return [{k: v for ti in t for k, v in ti} for t in itertools.product(*entries_list)]
+        for t in itertools.product(*entries_list):
+            yield {k: v for ti in t for k, v in ti.items()}
+        return
+
+    # Only the values of the common properties in the shortest list can be part of the result
+    shortest_entries = min(entries_list, key=len)
+    semijoin_keys = set([tuple([entry[k] for k in common_properties])
+                         for entry in shortest_entries])
 
     # Classify the entries of all lists that have the same values for the common properties
     joint = {}  # tuple(property_value) -> tuple(entries)
     for i, entries in enumerate(entries_list):
         for entry in entries:
             joint_key = tuple([entry[k] for k in common_properties])
+            if joint_key not in semijoin_keys:
+                continue
             if joint_key not in joint:
                 joint[joint_key] = tuple([[] for _ in range(len(entries_list))])
             joint[joint_key][i].append(entry)
 
     # Return the Cartesian product of all entries with the same shared properties
-    return_entries = []
     for joint_value in joint.values():
         for t in itertools.product(*joint_value):
             new_entry = {}
             for entry in t:
                 new_entry.update(entry)
-            return_entries.append(new_entry)
-    return return_entries
+            yield new_entry
 
 
 def get_entries_with_property_constrain(entries, entry_constrains, env):
     """
-    Return a list of entries after applying the constrains.
+    Return an iterator over the entries after applying the constrains.
     """
 
-    return_entries = []
     for entry in entries:
         new_entry = get_entry_after_property_constrains(entry, entry_constrains, env)
         if new_entry is not None:
-            return_entries.append(new_entry)
+            yield new_entry
+
+
+def get_template_fields(template):
+    """
+    Return the names of the properties interpolated in the template.
+    """
+
+    return [field for _, field, _, _ in string.Formatter().parse(template) if field is not None]
+
+
+def get_literal_prefix(regex):
+    """
+    Return a prefix shared by all strings matching the regular expression.
+    """
+
+    if "|" in regex:
+        return ""
+    prefix = []
+    for c in regex:
+        if c in ".^$*+?{}[]\\|()":
+            # The last character is optional with some quantifiers
+            if c in "*?{" and prefix:
+                prefix.pop()
+            break
+        prefix.append(c)
+    return "".join(prefix)
+
+
+# Value of properties missing in an entry
+missing_value = object()
+
+
+def get_interpolation_value(entry, env, prop):
+    """
+    Return the value that the property takes when interpolating on the entry.
+    """
+
+    if prop in entry:
+        return entry[prop]
+    if prop in env:
+        return env[prop]
+    return entry.get(f"{prop}@default", missing_value)
+
+
+def get_classify_matcher(patterns, subset, matchers):
+    """
+    Return a regular expression matching any of the patterns in the subset with the named groups
+    renamed as _c<pattern index>_<group name>, and the whole pattern captured as _c<pattern index>.
+    """
+
+    key = tuple([patterns[i] for i in subset])
+    if key not in matchers:
+        alternatives = []
+        for i in subset:
+            renamed = re.sub(r"\(\?P([<=])(\w+)",
+                             lambda m: f"(?P{m.group(1)}_c{i}_{m.group(2)}", patterns[i])
+            alternatives.append(f"(?P<_c{i}>{renamed})")
+        matchers[key] = re.compile("|".join(alternatives))
+    return matchers[key]
+
+
+def classify_entries(entries, classify_items, env):
+    """
+    Return for each classify item the list of entries selected by the item. Each entry is selected
+    at most by one item, the first one whose constrains are satisfied.
+
+    All items have "matching-re" on the same property. The regular expressions are interpolated
+    and compiled once for each distinct value of the properties they refer to, and merged into a
+    single regular expression, so that an entry is classified with a single match. Items whose
+    regular expression has a literal prefix that the property value doesn't start with are skipped
+    before matching.
+    """
+
+    prop = [k for k, c in classify_items[0]['select'].items()
+            if isinstance(c, dict) and 'matching-re' in c][0]
+    templates = [get_property_value(item['select'][prop]['matching-re'])
+                 for item in classify_items]
+    selects = [dict(item['select'], **{prop: {k: v for k, v in item['select'][prop].items()
+                                              if k != 'matching-re'}})
+               for item in classify_items]
+    fields = sorted(set([field for template in templates
+                         for field in get_template_fields(template)]))
+
+    classified_entries = [[] for _ in classify_items]
+    patterns_and_prefixes = {}  # tuple(field value) -> (patterns, prefixes)
+    matchers = {}  # tuple(pattern) -> compiled regular expression
+    for entry in entries:
+        if prop not in entry:
+            continue
+        value = entry[prop]
+
+        # Interpolate the regular expressions
+        key = tuple([get_interpolation_value(entry, env, field) for field in fields])
+        if key not in patterns_and_prefixes:
+            values = {field: v for field, v in zip(fields, key) if v is not missing_value}
+            patterns = []
+            for template in templates:
+                try:
+                    patterns.append(template.format(**values))
+                except KeyError:
+                    patterns.append(None)
+            patterns_and_prefixes[key] = (
+                patterns, [get_literal_prefix(p) if p is not None else None for p in patterns])
+        patterns, prefixes = patterns_and_prefixes[key]
+
+        # Match all regular expressions with a compatible prefix at once
+        subset = [i for i, prefix in enumerate(prefixes)
+                  if prefix is not None and value.startswith(prefix)]
+        if not subset:
+            continue
+        m = get_classify_matcher(patterns, subset, matchers).fullmatch(value)
+        if m is None:
+            continue
+
+        # Apply the rest of the constrains of the matching item; if they fail, try the next items
+        first = [i for i in subset if m.group(f"_c{i}") is not None][0]
+        for i in subset[subset.index(first):]:
+            if i == first:
+                group_prefix = f"_c{i}_"
+                groups = {k[len(group_prefix):]: v for k, v in m.groupdict().items()
+                          if k.startswith(group_prefix)}
+            else:
+                mi = re.fullmatch(patterns[i], value)
+                if not mi:
+                    continue
+                groups = mi.groupdict()
+            new_entry = get_entry_after_property_constrains(entry, selects[i], env)
+            if new_entry is None:
+                continue
+            new_entry.update(groups)
+            classified_entries[i].append(new_entry)
+            break
+    return classified_entries
+
+
+def parse_aggregate_function(function):
+    """
+    Return the name of the function and the property from strings like "count", "distinct:file",
+    "min:cfg_num", or "max:cfg_num".
+    """
+
+    name, _, prop = function.partition(":")
+    if name == "count" and not prop:
+        return name, None
+    if name in ("distinct", "min", "max") and prop:
+        return name, prop
+    raise ValueError(f'unexpected aggregate function `{function}`; expected "count", '
+                     '"distinct:<property>", "min:<property>", or "max:<property>"')
+
+
+def aggregate_key(value):
+    """
+    Return a key to compare property values, numerically if they are numbers.
+    """
+
+    try:
+        return (0, float(value), "")
+    except (TypeError, ValueError):
+        return (1, 0, str(value))
+
+
+def aggregate_entries(entries, group_by, aggregates):
+    """
+    Return an entry for each group of entries with the same values for the properties in
+    `group_by`, with those properties and the result of the aggregate functions. `aggregates` is a
+    dictionary from the name of the property with the result to the function, either "count",
+    "distinct:<property>", "min:<property>", or "max:<property>". Entries without some of the
+    properties in `group_by` are ignored, and so are the entries without the property of an
+    aggregate function for that function. The groups are returned in order of first appearance.
+    """
+
+    functions = [(name,) + parse_aggregate_function(f) for name, f in aggregates.items()]
+    groups = {}  # tuple(group_by values) -> {aggregate name: accumulated value}
+    for entry in entries:
+        if any([k not in entry for k in group_by]):
+            continue
+        acc = groups.setdefault(tuple([entry[k] for k in group_by]), {})
+        for name, function, prop in functions:
+            if function == "count":
+                acc[name] = acc.get(name, 0) + 1
+            elif prop not in entry:
+                continue
+            elif function == "distinct":
+                acc.setdefault(name, set()).add(entry[prop])
+            elif name not in acc:
+                acc[name] = entry[prop]
+            else:
+                acc[name] = (min if function == "min" else max)(acc[name], entry[prop],
+                                                                key=aggregate_key)
+
+    return_entries = []
+    for group_values, acc in groups.items():
+        new_entry = dict(zip(group_by, group_values))
+        for name, function, _ in functions:
+            if name not in acc:
+                continue
+            if function == "distinct":
+                new_entry[name] = str(len(acc[name]))
+            else:
+                new_entry[name] = str(acc[name])
+        return_entries.append(new_entry)
     return return_entries
 
 
+# Estimated memory used by an entry and by each property value, besides the characters
+ENTRY_OVERHEAD_BYTES = 250
+PROPERTY_OVERHEAD_BYTES = 60
+
+
+def estimate_entry_size(entry):
+    """
+    Return an estimation of the memory used by the entry in bytes.
+    """
+
+    return ENTRY_OVERHEAD_BYTES + sum(
+        [PROPERTY_OVERHEAD_BYTES + len(v) for v in entry.values() if v is not None])
+
+
+class SpillableList:
+    """
+    List of entries that keeps in memory at most some number of bytes. When the entries exceed
+    that, they are moved into a temporary file. The list can be iterated several times, and the
+    entries are returned in the same order as appended.
+    """
+
+    def __init__(self, memory_budget):
+        self.memory_budget = memory_budget
+        self.entries = []
+        self.entries_size = 0
+        self.runs = []
+        self.tmpdir = None
+        self.length = 0
+
+    def append(self, entry):
+        self.entries.append(entry)
+        self.entries_size += estimate_entry_size(entry)
+        self.length += 1
+        if self.entries_size > self.memory_budget:
+            self.spill()
+
+    def extend(self, entries):
+        for entry in entries:
+            self.append(entry)
+
+    def spill(self):
+        """
+        Move the entries in memory into a new temporary file.
+        """
+
+        if self.tmpdir is None:
+            self.tmpdir = tempfile.TemporaryDirectory(prefix="kaon-")
+        filename = os.path.join(self.tmpdir.name, f"run-{len(self.runs)}")
+        with open(filename, 'wt') as f:
+            for entry in self.entries:
+                f.write(json.dumps(entry))
+                f.write('\n')
+        if LOG_LEVEL > 0:
+            sys.stderr.write(f"Spilled {len(self.entries)} entries into {filename}\n")
+        self.runs.append(filename)
+        self.entries = []
+        self.entries_size = 0
+
+    def __iter__(self):
+        for filename in self.runs:
+            with open(filename, 'rt') as f:
+                for line in f:
+                    yield json.loads(line)
+        yield from self.entries
+
+    def __len__(self):
+        return self.length
+
+
+def collect_entries(entries, memory_budget):
+    """
+    Return a list with the entries, or a `SpillableList` if `memory_budget` is given.
+    """
+
+    if memory_budget is None:
+        return entries if isinstance(entries, list) else list(entries)
+    r = SpillableList(memory_budget)
+    r.extend(entries)
+    return r
+
+
+def parse_interval(value):
+    """
+    Return the number of seconds in strings like 90, 90s, 30m, or 1h.
+    """
+
+    suffixes = {'S': 1, 'M': 60, 'H': 3600}
+    if value and value[-1].upper() in suffixes:
+        return float(value[:-1]) * suffixes[value[-1].upper()]
+    return float(value)
+
+
+def parse_size(value):
+    """
+    Return the number of bytes in strings like 100, 10K, 2G, or 1T.
+    """
+
+    suffixes = {'K': 2**10, 'M': 2**20, 'G': 2**30, 'T': 2**40}
+    if value and value[-1].upper() in suffixes:
+        return int(float(value[:-1]) * suffixes[value[-1].upper()])
+    return int(value)
+
+
+def modify_entries(entries, modify_items, memory_budget=None):
+    """
+    Return an iterator over the entries after applying each of the modify items on all entries.
+    The entries are collected first if there are several modify items; with a memory budget, lists
+    are collected too, so that the entries can be spilled into disk.
+    """
+
+    modify_items = make_a_list(modify_items)
+    if len(modify_items) > 1 and not isinstance(entries, SpillableList) and \
+            (memory_budget is not None or not isinstance(entries, list)):
+        entries = collect_entries(entries, memory_budget)
+    return (new_entry for modify_item in modify_items
+            for entry in entries for new_entry in modify_entry(entry, modify_item))
+
+
 def modify_entry(entry, modify_item):
     """
     Apply the properties in modify_item to the entry.
@@ -575,13 +1681,19 @@ def modify_entry(entry, modify_item):
     return entries
 
 
-def execute_entries(entries, execute_item, env):
+def execute_entries(entries, execute_item, env, path="execute"):
     """
-    Execute some command and return entries from the output.
+    Execute some command and return an iterator over the entries from the output. The statistics
+    of the commands are recorded in COMMAND_STATS under `path`.
     """
 
-    new_entries = []
     expected_num_fields = len(execute_item['return-properties'])
+    timeout = get_duration(execute_item.get('timeout'))
+    retries = execute_item.get('retries', 0)
+    retry_backoff = get_duration(execute_item.get('retry-backoff', 1))
+    hedge_after = get_duration(execute_item.get('hedge-after'))
+    stats = COMMAND_STATS.setdefault(path, {'latencies': [], 'retries': 0, 'hedges': 0,
+                                            'timeouts': 0})
     for entry in entries:
         try:
             cmd = get_property_value(execute_item['command']).format(
@@ -590,16 +1702,382 @@ def execute_entries(entries, execute_item, env):
             continue
         if LOG_LEVEL > 0:
             sys.stderr.write(f"Executing commandline: {cmd}\n")
-        r = subprocess.run(cmd, stdout=subprocess.PIPE,
-                           universal_newlines=True, shell=True, check=True)
-        for line in r.stdout.splitlines():
+        for attempt in range(retries + 1):
+            start = time.monotonic()
+            try:
+                output = run_command(cmd, timeout, hedge_after, stats)
+                break
+            except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+                if isinstance(e, subprocess.TimeoutExpired):
+                    stats['timeouts'] += 1
+                if attempt == retries:
+                    raise
+                stats['retries'] += 1
+                sys.stderr.write(f"{e} Retrying in {retry_backoff * 2**attempt} seconds.\n")
+                time.sleep(retry_backoff * 2**attempt)
+            finally:
+                stats['latencies'].append(time.monotonic() - start)
+        for line in output.splitlines():
             line_elems = line.split(sep=execute_item.get('split', None))
             if len(line_elems) != expected_num_fields:
                 raise Exception(
                     f'Expected an output with {expected_num_fields} field(s) from output `{line}`')
-            new_entries.append(dict_with_defaults(entry, dict(zip(execute_item['return-properties'],
-                                                                  line_elems))))
-    return new_entries
+            yield dict_with_defaults(entry, dict(zip(execute_item['return-properties'],
+                                                     line_elems)))
+
+
+def run_command(cmd, timeout=None, hedge_after=None, stats=None):
+    """
+    Run the shell command and return its output. If `hedge_after` is given and the command hasn't
+    finished after that many seconds, a copy of the command is launched and the output of the
+    first copy finishing successfully is returned. Raise `subprocess.TimeoutExpired` if no copy
+    finishes after `timeout` seconds, and `subprocess.CalledProcessError` if all copies fail.
+    """
+
+    start = time.monotonic()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        running = {}  # future -> process
+
+        def launch():
+            # Start a new session so that all processes spawned by the shell can be killed
+            p = subprocess.Popen(cmd, stdout=subprocess.PIPE, universal_newlines=True, shell=True,
+                                 start_new_session=True)
+            running[executor.submit(lambda: p.communicate()[0])] = p
+
+        def kill_all():
+            for p in running.values():
+                try:
+                    os.killpg(p.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+
+        launch()
+        hedged = hedge_after is None
+        error = None
+        while running:
+            deadlines = [d for d in (timeout, None if hedged else hedge_after) if d is not None]
+            wait_time = max(min(deadlines) - (time.monotonic() - start), 0) if deadlines else None
+            done, _ = concurrent.futures.wait(running.keys(), timeout=wait_time,
+                                              return_when=concurrent.futures.FIRST_COMPLETED)
+            for f in done:
+                p = running.pop(f)
+                if p.returncode == 0:
+                    kill_all()
+                    return f.result()
+                error = subprocess.CalledProcessError(p.returncode, cmd, f.result())
+            elapsed = time.monotonic() - start
+            if timeout is not None and elapsed >= timeout and running:
+                kill_all()
+                raise subprocess.TimeoutExpired(cmd, timeout)
+            if not hedged and elapsed >= hedge_after:
+                hedged = True
+                if running:
+                    if stats is not None:
+                        stats['hedges'] += 1
+                    launch()
+        raise error
+
+
+def get_duration(value):
+    """
+    Return the number of seconds from a number or a string like 90s, 30m, or 1h, or None if the
+    value is None.
+    """
+
+    if value is None or isinstance(value, (int, float)):
+        return value
+    return parse_interval(value)
+
+
+def merge_command_stats(command_stats):
+    """
+    Add the statistics of commands executed by another process to COMMAND_STATS.
+    """
+
+    for path, stats in command_stats.items():
+        all_stats = COMMAND_STATS.setdefault(path, {'latencies': [], 'retries': 0, 'hedges': 0,
+                                                    'timeouts': 0})
+        all_stats['latencies'] += stats['latencies']
+        for k in ('retries', 'hedges', 'timeouts'):
+            all_stats[k] += stats[k]
+
+
+# Upper bounds in seconds of the bins in the latency histograms
+LATENCY_BINS = (0.1, 0.3, 1, 3, 10, 30, 100, 300, 1000)
+
+
+def print_latency_report(command_stats, f):
+    """
+    Print for each execute item the number of commands, the percentiles of the latency, the
+    number of retries, hedges, and timeouts, and a histogram of the latencies.
+    """
+
+    for path, stats in command_stats.items():
+        latencies = sorted(stats['latencies'])
+        if not latencies:
+            continue
+
+        def percentile(q):
+            return latencies[min(int(q * len(latencies)), len(latencies) - 1)]
+
+        f.write(f"{path}: {len(latencies)} command(s), p50 {percentile(.5):.2f}s, "
+                f"p90 {percentile(.9):.2f}s, p99 {percentile(.99):.2f}s, "
+                f"max {latencies[-1]:.2f}s, {stats['retries']} retries, {stats['hedges']} hedges, "
+                f"{stats['timeouts']} timeouts\n")
+        lower = 0
+        for upper in LATENCY_BINS + (None,):
+            n = len([t for t in latencies if t >= lower and (upper is None or t < upper)])
+            if n > 0:
+                label = f"<{upper}s" if upper is not None else f">={lower}s"
+                f.write(f"  {label:>8} {n:6} {'#' * max(1, 50 * n // len(latencies))}\n")
+            lower = upper
+
+
+#
+# Projection pushdown
+#
+
+
+def get_id_family(id_template):
+    """
+    Return the literal prefix of the id template; all ids computed with the template start with it.
+    """
+
+    return id_template.split("{", 1)[0]
+
+
+def union_or_any(a, b):
+    """
+    Return the union of two sets, where None stands for any value.
+    """
+
+    return None if a is None or b is None else a | b
+
+
+def get_select_properties(select_item):
+    """
+    Return the properties read by the select, and the properties that the select adds to the
+    entries.
+    """
+
+    read, produced = set(), set()
+    if not isinstance(select_item, dict):
+        for item in select_item[1:]:
+            item_read, item_produced = get_select_properties(item)
+            read |= item_read
+            produced |= item_produced
+        return read, produced
+    for prop, prop_constrains in select_item.items():
+        read.add(prop)
+        if not isinstance(prop_constrains, dict):
+            continue
+        if "interpolate" in prop_constrains:
+            read.update(get_template_fields(get_property_value(prop_constrains["interpolate"])))
+            produced.add(prop)
+        if "matching-re" in prop_constrains:
+            regex = get_property_value(prop_constrains["matching-re"])
+            read.update([f for f in get_template_fields(regex) if re.fullmatch(r"\w+", f)])
+            produced.update(re.findall(r"\(\?P<(\w+)>", regex))
+        for k in ("copy-to", "move-to"):
+            if prop_constrains.get(k) is not None:
+                produced.add(prop_constrains[k])
+    return read, produced
+
+
+def get_selected_families(select_item, may_have, may_kinds):
+    """
+    Return the families with entries that may pass the select, given the properties and the kinds
+    that the entries of each family may have.
+    """
+
+    if not isinstance(select_item, dict):
+        return set().union(*[get_selected_families(item, may_have, may_kinds)
+                             for item in select_item[1:]])
+    families = set()
+    for family in may_have.keys():
+        for prop, prop_constrains in select_item.items():
+            restriction, values = get_property_restriction(prop_constrains)
+            if restriction not in ('values', 'present'):
+                continue
+            if may_have[family] is not None and prop not in may_have[family]:
+                break
+            if (prop == 'kind' and restriction == 'values' and may_kinds[family] is not None and
+                    not may_kinds[family] & set(values)):
+                break
+        else:
+            families.add(family)
+    return families
+
+
+def get_writers(schema):
+    """
+    Return a description of how each action, or each item of a "classify", inserts entries: a
+    list of dictionaries with the action index, the classify item index, the id template, the
+    select, the modify and finalize items, and the properties from executing commands.
+    """
+
+    writers = []
+    for i, action in enumerate(schema):
+        if 'classify' in action:
+            for j, item in enumerate(action['classify']):
+                writers.append({'action': i, 'item': j, 'id': item['id'], 'select': item['select'],
+                                'entries': False, 'modify': [],
+                                'finalize': make_a_list(item.get('finalize', [{}])),
+                                'execute': set(), 'read': set(), 'group-by': None})
+            continue
+        read = set()
+        execute = set()
+        for execute_item in make_a_list(action.get('execute', [])):
+            read.update(get_template_fields(get_property_value(execute_item['command'])))
+            execute.update(execute_item['return-properties'])
+        read.update(get_template_fields(action.get('id', '')))
+        group_by = None
+        if 'group-by' in action or 'aggregate' in action:
+            group_by = action.get('group-by', [])
+            read.update(group_by)
+            for f in action.get('aggregate', {}).values():
+                read.add(parse_aggregate_function(f)[1])
+            read.discard(None)
+            execute.update(action.get('aggregate', {'count': 'count'}).keys())
+        if 'shard-by' in action:
+            read.add(action['shard-by'])
+        writers.append({'action': i, 'item': None, 'id': action.get('id'),
+                        'select': action.get('select'), 'entries': 'entries' in action,
+                        'modify': make_a_list(action.get('modify', [{}])),
+                        'finalize': make_a_list(action.get('finalize', [{}])),
+                        'execute': execute, 'read': read, 'group-by': group_by})
+    return writers
+
+
+def get_written_kinds(writer, passed_kinds):
+    """
+    Return the values of "kind" that the entries inserted by the writer may have, None standing
+    for entries without "kind". The kinds of the selected entries are `passed_kinds`.
+    """
+
+    kinds = set()
+    for item in writer['modify'] + writer['finalize']:
+        for k in ('kind', 'kind@default'):
+            if k in item:
+                kinds.update(make_a_list(get_property_value(item[k])))
+    if all(['kind' in item for item in writer['finalize']]) or (
+            all(['kind' in item for item in writer['modify']]) and
+            not any(['kind' in item or 'kind@default' in item for item in writer['finalize']])):
+        return kinds
+    return union_or_any(kinds, passed_kinds)
+
+
+def prune_schema(schema, output_attributes, constrained_view):
+    """
+    Return the schema without the actions, and the trailing "classify" items, that can't change
+    the entries satisfying the view or the values of `output_attributes` on them, nor the order
+    of those entries.
+
+    The entries are grouped in families by the literal prefix of their ids; two families whose
+    prefixes are one the prefix of the other are the same family. A forward pass finds which
+    properties and kinds the entries in each family may have, and so which families each select
+    may read. The families that may have entries to output are those with some of the output
+    attributes and, if the view restricts "kind", with some of the allowed kinds. A backward pass
+    keeps the actions inserting entries in those families or properties read by later kept
+    actions; actions reading a family require all actions inserting entries in that family.
+    Actions without "id" are always kept because they may execute commands.
+    """
+
+    writers = get_writers(schema)
+
+    # Merge the families with related prefixes
+    prefixes = set([get_id_family(w['id']) for w in writers if w['id'] is not None])
+    family_of = {}
+    for prefix in sorted(prefixes, key=len):
+        family_of[prefix] = next((family_of[p] for p in family_of if prefix.startswith(p)),
+                                 prefix)
+    for w in writers:
+        w['family'] = family_of[get_id_family(w['id'])] if w['id'] is not None else None
+
+    # Forward pass: properties and kinds that the entries of each family may have
+    may_have = {}  # family -> set of properties or None if unknown
+    may_kinds = {}  # family -> set of kinds or None if unknown
+    for w in writers:
+        select_read, select_produced = (get_select_properties(w['select'])
+                                        if w['select'] is not None else (set(), set()))
+        w['read'] = w['read'] | select_read
+        w['selected'] = (get_selected_families(w['select'], may_have, may_kinds)
+                         if w['select'] is not None else set())
+        passed = set()
+        passed_kinds = set([None])
+        if w['group-by'] is None or 'kind' in w['group-by']:
+            for family in w['selected']:
+                passed = union_or_any(passed, may_have[family])
+                passed_kinds = union_or_any(passed_kinds, may_kinds[family])
+        if w['group-by'] is not None and passed is not None:
+            passed &= set(w['group-by'])
+        written = select_produced | w['execute'] | set(
+            [k[:-len("@default")] if k.endswith("@default") else k
+             for item in w['modify'] + w['finalize'] for k in item.keys()])
+        w['written'] = union_or_any(written, passed)
+        if w['entries']:
+            w['written'] = None
+        if w['family'] is None:
+            continue
+        kinds = get_written_kinds(w, passed_kinds) if 'kind' not in select_produced | w['execute'] \
+            else None
+        may_have[w['family']] = union_or_any(may_have.get(w['family'], set()), w['written'])
+        may_kinds[w['family']] = union_or_any(may_kinds.get(w['family'], set()), kinds)
+
+    # Families with entries that may be output
+    view_kinds = set()
+    for view in constrained_view:
+        view_kinds = union_or_any(view_kinds, set(view['kind']) if 'kind' in view else None)
+    view_properties = set([k for view in constrained_view for k in view.keys()])
+    needed = {}  # family -> set of needed properties or None if all
+    required = set()  # families whose entries must be all inserted
+    for family in may_have.keys():
+        if may_have[family] is not None and not may_have[family] & set(output_attributes):
+            continue
+        if (view_kinds is not None and may_kinds[family] is not None and
+                None not in may_kinds[family] and not may_kinds[family] & view_kinds):
+            continue
+        needed[family] = set(output_attributes) | view_properties
+        required.add(family)
+
+    # Backward pass: keep the writers that may change the needed properties; a "classify" item
+    # is kept if a later item in the same action is, because the first matching item is taken
+    live = set()
+    last_live_items = {}  # action index -> last classify item kept
+    for w in reversed(writers):
+        family = w['family']
+        if not (family is None or w['entries'] or family in required or needed.get(family, set())
+                is None or w['written'] is None or w['written'] & needed.get(family, set()) or
+                w['action'] in last_live_items):
+            continue
+        live.add((w['action'], w['item']))
+        if w['item'] is not None:
+            last_live_items.setdefault(w['action'], w['item'])
+        for selected in w['selected']:
+            required.add(selected)
+            passed_needed = needed.get(family, set()) if w['group-by'] is None else set()
+            needed[selected] = union_or_any(needed.get(selected, set()),
+                                            union_or_any(w['read'], passed_needed))
+
+    # Remove the actions and the classify items after the last one kept in each action
+    pruned_schema = []
+    for i, action in enumerate(schema):
+        if 'classify' in action:
+            items = action['classify']
+            num_items = max([j + 1 for j in range(len(items)) if (i, j) in live] + [0])
+            if num_items > 0:
+                pruned_schema.append(dict(action, classify=items[:num_items]))
+            removed = [item.get('name', f"[{i}]/classify/[{j}]")
+                       for j, item in enumerate(items[num_items:], num_items)]
+        elif (i, None) in live:
+            pruned_schema.append(action)
+            removed = []
+        else:
+            removed = [action.get('name', f"[{i}]")]
+        if LOG_LEVEL > 0 or EXPLAIN:
+            for name in removed:
+                sys.stderr.write(f"Skipping `{name}`, which doesn't affect the output\n")
+    return pruned_schema
 
 #
 # Read/write schemas, constrains, and artifacts
@@ -615,7 +2093,13 @@ def get_schema_from_json(json_files):
     for filename in json_files:
         try:
             f = sys.stdin if filename == '-' else open(filename, 'rt')
-            schema_item = json.load(f)
+            content = f.read()
+            if not content.strip() or content.lstrip().startswith('{'):
+                # Snapshot, see `print_artifacts_as_snapshot`
+                schema_item = [{'name': f"snapshot {filename}",
+                                'entries': dict(read_snapshot(content.splitlines(), filename))}]
+            else:
+                schema_item = json.loads(content)
             check_schema(schema_item)
             if filename != '-':
                 f.close()
@@ -625,6 +2109,49 @@ def get_schema_from_json(json_files):
     return schema
 
 
+def read_snapshot(lines, filename):
+    """
+    Return the pairs (id, entry) in a snapshot, checking that the ids are sorted.
+    """
+
+    last_id = None
+    for line in lines:
+        if not line.strip():
+            continue
+        item = json.loads(line)
+        if last_id is not None and item['id'] <= last_id:
+            raise ValueError(f"Snapshot {filename} isn't sorted by id at id `{item['id']}`")
+        last_id = item['id']
+        yield item['id'], item['entry']
+
+
+def merge_snapshots(filenames, f):
+    """
+    Write into `f` the snapshot resulting from inserting the entries of all snapshots in the same
+    order as given. The snapshots are read at the same time, one line from each at a time.
+    """
+
+    def keyed(i, filename, f):
+        # Entries with the same id are sorted by the position of the snapshot
+        for id, entry in read_snapshot(f, filename):
+            yield id, i, entry
+
+    files = [open(filename, 'rt') for filename in filenames]
+    try:
+        snapshots = [keyed(i, filename, fi)
+                     for i, (filename, fi) in enumerate(zip(filenames, files))]
+        for id, group in itertools.groupby(heapq.merge(*snapshots, key=lambda t: t[0:2]),
+                                           key=lambda t: t[0]):
+            entry = None
+            for _, _, new_entry in group:
+                entry = update_entry(entry, new_entry)
+            f.write(json.dumps({'id': id, 'entry': entry}, sort_keys=True))
+            f.write('\n')
+    finally:
+        for fi in files:
+            fi.close()
+
+
 def normalize_value_constrain(values):
     """
     Return a set of possible options allowed for each attribute.
@@ -745,6 +2272,78 @@ def print_artifacts_as_schema(artifacts, output_attributes):
     json.dump(schema, sys.stdout, indent=4, sort_keys=True)
     sys.stdout.write('\n')
 
+
+def print_artifacts_as_snapshot(artifacts_by_id, output_attributes):
+    """
+    Print each artifact in a line as a JSON object with the id and the artifact, sorted by id.
+    Filter the properties to show in each artifact.
+    """
+
+    for id in sorted(artifacts_by_id.keys()):
+        artifacts = restrict_output_attributes([artifacts_by_id[id]], output_attributes,
+                                               ignore_doc_attributes=False)
+        for artifact in artifacts:
+            sys.stdout.write(json.dumps({'id': id, 'entry': artifact}, sort_keys=True))
+            sys.stdout.write('\n')
+
+
+def get_artifacts_changes(old_artifacts_by_id, artifacts_by_id):
+    """
+    Return the differences between two evaluations as a list of dictionaries with the id, the
+    change (added, removed, or changed), and the entry. The changed entries have also the names
+    of the properties that were added, removed, or have a different value.
+    """
+
+    changes = []
+    for id, artifact in artifacts_by_id.items():
+        if id not in old_artifacts_by_id:
+            changes.append({'id': id, 'change': 'added', 'entry': artifact})
+            continue
+        old_artifact = old_artifacts_by_id[id]
+        changed_properties = sorted([k for k in set(artifact.keys()) | set(old_artifact.keys())
+                                     if artifact.get(k) != old_artifact.get(k) or
+                                     (k in artifact) != (k in old_artifact)])
+        if changed_properties:
+            changes.append({'id': id, 'change': 'changed', 'entry': artifact,
+                            'changed-properties': changed_properties})
+    for id, old_artifact in old_artifacts_by_id.items():
+        if id not in artifacts_by_id:
+            changes.append({'id': id, 'change': 'removed', 'entry': old_artifact})
+    return changes
+
+
+def watch_artifacts(evaluate, output_attributes, interval, max_evaluations=None):
+    """
+    Call `evaluate` every `interval` seconds, and print the changes in the artifacts it returns
+    from the previous call, each change in a line as a JSON object. All artifacts are printed as
+    added after the first call. If an evaluation fails, the error is reported and the changes are
+    computed from the last successful evaluation.
+    """
+
+    old_artifacts_by_id = {}
+    num_evaluations = 0
+    while True:
+        try:
+            artifacts_by_id = {}
+            for id, artifact in evaluate().items():
+                for artifact in restrict_output_attributes([artifact], output_attributes,
+                                                           ignore_doc_attributes=False):
+                    artifacts_by_id[id] = artifact
+        except Exception as e:
+            sys.stderr.write(f"Error evaluating the schema: {e}\n")
+            artifacts_by_id = None
+        if artifacts_by_id is not None:
+            for change in get_artifacts_changes(old_artifacts_by_id, artifacts_by_id):
+                sys.stdout.write(json.dumps(change, sort_keys=True))
+                sys.stdout.write('\n')
+            sys.stdout.flush()
+            old_artifacts_by_id = artifacts_by_id
+        num_evaluations += 1
+        if max_evaluations is not None and num_evaluations >= max_evaluations:
+            break
+        time.sleep(interval)
+
+
 #
 # Commandline
 #
@@ -757,7 +2356,7 @@ def get_options_from_schema(schema):
 
     r = {}
     for action in schema:
-        if 'select' in action or 'execute' in action:
+        if 'select' in action or 'execute' in action or 'classify' in action:
             continue
         for entry in execute_schema([action], [{}], {}):
             if "option-name" in entry and "option-doc" in entry:
@@ -773,7 +2372,7 @@ def get_variables_from_schema(schema):
 
     r = {}
     for action in schema:
-        if 'select' in action or 'execute' in action:
+        if 'select' in action or 'execute' in action or 'classify' in action:
             continue
         for entry in execute_schema([action], [{}], {}):
             if "variable-name" in entry and "variable-doc" in entry:
@@ -796,7 +2395,7 @@ def get_constrained_view(constrains, view):
     for constrain in constrains:
         new_constrain = dict(**constrain)
         for k, v in view.items():
-            new_constrain[k] = new_constrain[k].intersect(v) if k in new_constrain else v
+            new_constrain[k] = new_constrain[k] & v if k in new_constrain else v
         output_constrains.append(new_constrain)
     return output_constrains
 
@@ -845,6 +2444,16 @@ $ kaon.py --kind configuration eigenvector --cfg_dir cl21_48_96_b6p3_m0p2416_m0p
     parser.add_argument('--constrains', help='JSON file with a list of constrains', nargs='+',
                         required=False, default=[])
     parser.add_argument('--log', action='store_true', default=False, required=False)
+    parser.add_argument('--latency-report', action='store_true', default=False, required=False,
+                        help='print on the standard error the latencies of the commands executed '
+                        'by each execute item')
+    parser.add_argument('--explain', action='store_true', default=False, required=False,
+                        help='print on the standard error the estimated and the actual number of '
+                        'entries selected by each action and by each branch of the joints, '
+                        'and the join properties restricting each branch')
+    parser.add_argument('--merge', metavar='snapshot', nargs='+', required=False,
+                        help='print the snapshot resulting from merging the given snapshots; the '
+                        'entries in later snapshots take precedence')
     try:
         args = parser.parse_known_args()
     except Exception as e:
@@ -852,6 +2461,10 @@ $ kaon.py --kind configuration eigenvector --cfg_dir cl21_48_96_b6p3_m0p2416_m0p
         parser.print_help()
         sys.exit(1)
 
+    if args[0].merge:
+        merge_snapshots(args[0].merge, sys.stdout)
+        sys.exit(0)
+
     if "inputs" not in args[0] or not args[0].inputs:
         show_help = args[0].help if "help" in args[0] else False
         if not show_help:
@@ -875,14 +2488,44 @@ $ kaon.py --kind configuration eigenvector --cfg_dir cl21_48_96_b6p3_m0p2416_m0p
         attributes_str)
     parser.add_argument(
         '--output-format', dest='output_format', nargs=1, required=False,
-        choices=['headless-table', 'table', 'json', 'schema'],
+        choices=['headless-table', 'table', 'json', 'schema', 'snapshot'],
         default=['headless-table'],
         help='how to print the artifacts, in table form with headers (table) '
         'or without headers (headless-table), in a list of dictionaries (json), '
-        'or as KaoN schema (schema)')
+        'as KaoN schema (schema), or as a line for each artifact with its id sorted by id '
+        '(snapshot)')
     parser.add_argument(
         '--column-sep', metavar='<sep>', nargs=1, required=False,
         help='column separation when printing a table', default=[' '])
+    parser.add_argument(
+        '--jobs', metavar='<num>', nargs=1, required=False, type=int, default=[1],
+        help='maximum number of processes executing the actions with "shard-by"')
+    parser.add_argument(
+        '--memory-budget', metavar='<size>', nargs=1, required=False, type=parse_size,
+        default=[None],
+        help='store the intermediate entries of an action exceeding this size in temporary '
+        'files, eg. 4G')
+    parser.add_argument(
+        '--store', metavar='<store>', nargs=1, required=False, default=['memory'],
+        help='where to keep the entries, either in memory (memory) or in a SQLite database that '
+        'persists after the execution (sqlite:<filename>)')
+    parser.add_argument(
+        '--from-store', action='store_true', default=False, required=False,
+        help='output the entries in the database given with --store by a previous execution '
+        'instead of executing the schema')
+    parser.add_argument(
+        '--group-by', metavar='<attr>', nargs='+', required=False,
+        help='output an entry for each group of entries with the same values of these attributes '
+        'with the results of --aggregate')
+    parser.add_argument(
+        '--aggregate', metavar='<function>', nargs='+', required=False,
+        help='functions computed for each group of --group-by, any of count, distinct:<attr>, '
+        'min:<attr>, and max:<attr>; by default count')
+    parser.add_argument(
+        '--watch', metavar='<interval>', nargs=1, required=False, type=parse_interval,
+        default=[None],
+        help='evaluate the schema every interval, eg. 30m, and print the entries added, removed, '
+        'or changed from the previous evaluation, each as a JSON object in a line')
     group_attributes = {}
     for k, v, g in attribute_options:
         if g not in group_attributes:
@@ -919,16 +2562,70 @@ $ kaon.py --kind configuration eigenvector --cfg_dir cl21_48_96_b6p3_m0p2416_m0p
         env[k] = vars_args[k][0]
 
     # Set log level
+    global LOG_LEVEL, EXPLAIN
     LOG_LEVEL = 1 if args.log else 0
+    EXPLAIN = args.explain
 
     # Execute the scheme
-    artifacts = execute_schema(schema, constrained_view, env)
+    try:
+        store_kind, _ = parse_store_spec(args.store[0])
+    except ValueError as e:
+        parser.error(str(e))
+    if args.from_store and store_kind != "sqlite":
+        parser.error("--from-store requires --store sqlite:<filename>")
+    aggregates = None
+    if args.group_by or args.aggregate:
+        aggregates = {f: f for f in args.aggregate or ['count']}
+        for f in aggregates:
+            try:
+                parse_aggregate_function(f)
+            except ValueError as e:
+                parser.error(str(e))
+
+    # Skip the actions that don't affect the output, unless the entries are stored for later
+    needed_attributes = args.show
+    if aggregates is not None:
+        needed_attributes = (args.group_by + [prop for _, prop in map(parse_aggregate_function,
+                                                                      aggregates.values())
+                                              if prop is not None]) if args.group_by else None
+    if needed_attributes is not None and store_kind == "memory":
+        schema = prune_schema(schema, needed_attributes, constrained_view)
+
+    def evaluate():
+        store = get_store(args.store[0], clear=not args.from_store)
+        try:
+            if not args.from_store:
+                execute_schema_by_id(schema, env, jobs=args.jobs[0],
+                                     memory_budget=args.memory_budget[0], store=store)
+            if args.latency_report:
+                print_latency_report(COMMAND_STATS, sys.stderr)
+            artifacts_by_id = dict(store.get_items_in_view(constrained_view))
+        finally:
+            # With --watch, the store is opened again in the next evaluation
+            store.close()
+        if aggregates is None:
+            return artifacts_by_id
+
+        # The id of a group is given by the values of the properties in --group-by
+        group_by = args.group_by or []
+        return {json.dumps([artifact[k] for k in group_by]): artifact
+                for artifact in aggregate_entries(artifacts_by_id.values(), group_by, aggregates)}
 
-    # Print the results
     output_attributes = args.show
+    if output_attributes is None and aggregates is not None:
+        output_attributes = (args.group_by or []) + list(aggregates.keys())
+    if args.watch[0] is not None:
+        watch_artifacts(evaluate, output_attributes, args.watch[0])
+        return
+    artifacts_by_id = evaluate()
+    artifacts = list(artifacts_by_id.values())
+
+    # Print the results
     output_format = args.output_format[0]
     column_separator = args.column_sep[0]
-    if output_format in ['table', 'headless-table']:
+    if output_format == 'snapshot':
+        print_artifacts_as_snapshot(artifacts_by_id, output_attributes)
+    elif output_format in ['table', 'headless-table']:
         print_artifacts_as_table(artifacts, output_attributes,
                                  output_format == 'table', column_separator)
     elif output_format == 'json':
@@ -942,6 +2639,8 @@ def do_test():
     Minimal tests.
     """
 
+    global EXPLAIN
+
     # Check simple schema with values
     schema = [{
         "modify": [
@@ -987,6 +2686,230 @@ def do_test():
                       {"prefix": "pre1", "o0": "pre1", "o1": "2", "o2": "v2"}]
     assert execute_schema(schema, [{}], {}) == true_artifacts
 
+    # Check classify
+    schema = [{
+        "modify": {"dir": "d", "file": ["d/cfg_1.lime", "d/eig_1", "d/eig_2", "e/cfg_3.lime"]},
+        "finalize": {"kind": "file"},
+        "id": "file-{file}"
+    }, {
+        "classify": [{
+            "select": {"file": {"move-to": "cfg_file",
+                                "matching-re": r"{dir}/cfg_(?P<num>\d+).lime"},
+                       "kind": "file"},
+            "finalize": {"kind": "configuration"},
+            "id": "cfg-{num}"
+        }, {
+            "select": {"file": {"move-to": "eig_file", "matching-re": r"{dir}/eig_(?P<num>\d+)"},
+                       "kind": "file"},
+            "finalize": {"kind": "eigenvector"},
+            "id": "eig-{num}"
+        }]
+    }]
+    check_schema(schema)
+    true_artifacts = [{"kind": "configuration", "dir": "d", "cfg_file": "d/cfg_1.lime", "num": "1"},
+                      {"kind": "eigenvector", "dir": "d", "eig_file": "d/eig_1", "num": "1"},
+                      {"kind": "eigenvector", "dir": "d", "eig_file": "d/eig_2", "num": "2"}]
+    assert (execute_schema(schema, [{'kind': ['configuration', 'eigenvector']}], {}) ==
+            true_artifacts)
+
+    # Check sharding
+    schema = [{
+        "modify": {"dir": ["d0", "d1", "d2"], "kind": "dir"},
+        "id": "{dir}"
+    }, {
+        "select": {"kind": "dir"},
+        "modify": [{"n": "0"}, {"n": ["1", "2"]}],
+        "execute": {
+            "command": "for i in `seq 2` ; do echo {dir}_f{n}_$i; done",
+            "return-properties": ["file"]
+        },
+        "finalize": [{"kind": "file"}, {"kind": "other"}],
+        "shard-by": "dir",
+        "id": "{kind}-{file}"
+    }]
+    check_schema(schema)
+    assert execute_schema(schema, [{}], {}, jobs=2) == execute_schema(schema, [{}], {})
+
+    # Check joints and the estimations
+    schema = [{
+        "modify": [{"kind": "eig", "cfg": "1"}, {"kind": "eig", "cfg": "2"}],
+        "id": "{kind}-{cfg}"
+    }, {
+        "modify": [{"kind": "prop", "cfg": "1", "t": "0"}, {"kind": "prop", "cfg": "3", "t": "0"}],
+        "id": "{kind}-{cfg}-{t}"
+    }, {
+        "select": ["joint", {"kind": {"in": ["prop"], "move-to": None}},
+                   {"kind": {"in": ["eig"], "move-to": None}}],
+        "id": "joint-{cfg}-{t}"
+    }]
+    assert execute_schema(schema, [{'kind': [None]}], {}) == [{"cfg": "1", "t": "0"}]
+    store = EntryStore()
+    for id, entry in execute_schema_by_id(schema[0:2], {}).items():
+        store[id] = entry
+    assert store.estimate(schema[2]['select'][1]) == 2
+    assert store.estimate({"kind": "eig", "cfg": "1"}) == 1
+    assert store.estimate({"t": {"in": []}}) == 2
+    assert store.estimate({"kind": "eig", "cfg": "3"}) == 1
+    assert store.estimate({"kind": "eig", "cfg": "4"}) == 0
+    del store["eig-1"]
+    assert store.value_counts['kind'] == {"eig": 1, "prop": 2}
+
+    # Check pushing the values of the join properties of the smallest branch into the others
+    select_item = ["joint", {"kind": {"in": ["prop"], "move-to": None}, "cfg": {}},
+                   {"kind": "eig", "cfg": ["1", "2", "3"], "t": {"in": []}}]
+    assert get_joint_keys([{"cfg": "1"}, {"cfg": "3"}], select_item[1:]) == {"cfg": {"1", "3"}}
+    assert get_joint_keys([{"cfg": "1"}, {}], select_item[1:]) == {}
+    assert get_joint_keys([{"cfg": "1"}], [select_item[1], {"cfg": {"move-to": "c"}}]) == {}
+    assert (restrict_select_to_keys(select_item[1], {"cfg": {"3", "1"}})["cfg"] ==
+            {"in": ["1", "3"]})
+    assert restrict_select_to_keys(select_item[2], {"cfg": {"3", "4"}})["cfg"] == ["3"]
+    assert restrict_select_to_keys(select_item[1], {"cfg": set()})["cfg"] == []
+    joint_schema = [{"modify": {"kind": "eig", "cfg": [str(i) for i in range(100)]},
+                     "id": "eig-{cfg}"},
+                    {"modify": [{"kind": "prop", "cfg": "3", "t": "0"},
+                                {"kind": "prop", "cfg": "200", "t": "0"}], "id": "prop-{cfg}-{t}"},
+                    {"select": ["joint", {"kind": {"in": ["prop"], "move-to": None}, "cfg": {}},
+                                {"kind": {"in": ["eig"], "move-to": None}, "cfg": {}}],
+                     "id": "joint-{cfg}-{t}"}]
+    for store in (EntryStore(), SqliteEntryStore(":memory:")):
+        err = io.StringIO()
+        EXPLAIN = True
+        try:
+            with contextlib.redirect_stderr(err):
+                entries = execute_schema_by_id(joint_schema, {}, store=store)
+        finally:
+            EXPLAIN = False
+        assert [entries[id] for id in entries if id.startswith("joint")] == [
+            {"cfg": "3", "t": "0"}]
+        assert "select/[2]: semi-join on cfg (2 values) from select/[1]" in err.getvalue()
+        assert "select/[2]: estimated 3 rows, actual 1 rows" in err.getvalue()
+
+    # Check the SQLite store
+    with tempfile.TemporaryDirectory() as tmpdir:
+        store = execute_schema_by_id(schema, {}, store=SqliteEntryStore(f"{tmpdir}/entries.db"))
+        assert store == execute_schema_by_id(schema, {})
+        store = SqliteEntryStore(f"{tmpdir}/entries.db", clear=False)
+        assert store.get_candidates({"kind": "eig", "cfg": {}}) == [{"kind": "eig", "cfg": "1"},
+                                                                    {"kind": "eig", "cfg": "2"}]
+        assert store.get_items_in_view([{"cfg": ["1"], "t": ["0"]}]) == [
+            ("eig-1", {"kind": "eig", "cfg": "1"}),
+            ("prop-1-0", {"kind": "prop", "cfg": "1", "t": "0"}),
+            ("joint-1-0", {"cfg": "1", "t": "0"})]
+        assert store.estimate({"t": {"in": []}}) == 2
+        # Sets of values beyond the limit of parameters in SQLite
+        many_cfgs = set([str(i) for i in range(40000)])
+        assert store.get_items_in_view([{"cfg": many_cfgs, "t": {"0"}}]) == [
+            ("eig-1", {"kind": "eig", "cfg": "1"}), ("eig-2", {"kind": "eig", "cfg": "2"}),
+            ("prop-1-0", {"kind": "prop", "cfg": "1", "t": "0"}),
+            ("prop-3-0", {"kind": "prop", "cfg": "3", "t": "0"}),
+            ("joint-1-0", {"cfg": "1", "t": "0"})]
+        assert len(store.get_candidates({"cfg": [str(i) for i in range(40000)]})) == 5
+        assert store.db.execute("SELECT count(*) FROM temp.value_sets").fetchone()[0] == 0
+        store.close()
+
+    # Check the changes between evaluations
+    assert get_artifacts_changes({"a": {"x": "1"}, "b": {"x": "1"}, "c": {"x": "1"}},
+                                 {"a": {"x": "1"}, "b": {"x": "2", "y": "1"}, "d": {}}) == [
+        {"id": "b", "change": "changed", "entry": {"x": "2", "y": "1"},
+         "changed-properties": ["x", "y"]},
+        {"id": "d", "change": "added", "entry": {}},
+        {"id": "c", "change": "removed", "entry": {"x": "1"}}]
+
+    # Check timeouts, retries, and hedging
+    with tempfile.TemporaryDirectory() as tmpdir:
+        assert run_command("echo hi", timeout=5) == "hi\n"
+        try:
+            run_command("sleep 5", timeout=0.2)
+            assert False
+        except subprocess.TimeoutExpired:
+            pass
+        # The first copy hangs and the hedged copy finishes
+        stats = {'latencies': [], 'retries': 0, 'hedges': 0, 'timeouts': 0}
+        cmd = f"mkdir {tmpdir}/first 2>/dev/null && sleep 5; echo done"
+        assert run_command(cmd, timeout=3, hedge_after=0.2, stats=stats) == "done\n"
+        assert stats['hedges'] == 1
+        # The command fails the first time and succeeds when retried
+        cmd = f"if mkdir {tmpdir}/retry 2>/dev/null; then false; else echo x; fi"
+        schema = [{"execute": {"command": cmd, "return-properties": ["x"], "retries": 1,
+                               "retry-backoff": 0}, "id": "{x}"}]
+        check_schema(schema)
+        err = io.StringIO()
+        with contextlib.redirect_stderr(err):
+            assert execute_schema(schema, [{}], {}) == [{"x": "x"}]
+        assert "Retrying in 0 seconds" in err.getvalue()
+        assert COMMAND_STATS["[0]/execute/[0]"]['retries'] == 1
+        # The statistics are only kept for the last execution
+        assert execute_schema(schema, [{}], {}) == [{"x": "x"}]
+        assert len(COMMAND_STATS["[0]/execute/[0]"]['latencies']) == 1
+
+    # Check aggregations
+    entries = [{"dir": "a", "num": "9", "st": "tape"}, {"dir": "a", "num": "10", "st": "tape"},
+               {"dir": "b", "num": "1", "st": "none"}, {"dir": "a", "num": "9"}, {"num": "3"}]
+    assert aggregate_entries(entries, ["dir"], {"n": "count", "d": "distinct:num",
+                                                "lo": "min:num", "hi": "max:num",
+                                                "st": "min:st"}) == [
+        {"dir": "a", "n": "3", "d": "2", "lo": "9", "hi": "10", "st": "tape"},
+        {"dir": "b", "n": "1", "d": "1", "lo": "1", "hi": "1", "st": "none"}]
+    schema = [{"modify": entries, "id": "{num}"},
+              {"select": {"st": {}}, "group-by": ["st"], "id": "count-{st}"}]
+    check_schema(schema)
+    assert execute_schema(schema, [{"st": ["tape"]}], {})[-1] == {"st": "tape", "count": "2"}
+
+    # Check skipping actions that don't affect the output
+    schema = [{"modify": {"kind": "a", "x": ["1", "2"]}, "id": "a-{x}"},
+              {"modify": {"kind": "b", "y": "1"}, "id": "b-{y}"},
+              {"select": {"kind": "a"}, "modify": {"z": "3"}, "finalize": {"kind": "c"},
+               "id": "c-{x}"},
+              {"select": {"kind": "b"}, "modify": {"w": "4"}, "id": "b-{y}"}]
+    assert prune_schema(schema, ["x"], [{"kind": {"a"}}]) == schema[0:1]
+    assert prune_schema(schema, ["z"], [{}]) == schema[0:1] + schema[2:3]
+    assert prune_schema(schema, ["w"], [{}]) == schema[1:2] + schema[3:]
+
+    # Check that actions without id execute the commands
+    with tempfile.TemporaryDirectory() as tmpdir:
+        touch_schema = [{"execute": {"command": f"touch {tmpdir}/touched",
+                                     "return-properties": []}}]
+        assert execute_schema(touch_schema, [{}], {}) == []
+        assert os.path.exists(os.path.join(tmpdir, "touched"))
+
+    # Check spilling into disk the product of a joint collected for several modify items
+    schema = [{"modify": {"kind": "a", "x": [str(i) for i in range(100)]}, "id": "a-{x}"},
+              {"modify": {"kind": "b", "y": [str(i) for i in range(100)]}, "id": "b-{y}"},
+              {"select": ["joint", {"kind": {"in": ["a"], "move-to": None}},
+                          {"kind": {"in": ["b"], "move-to": None}}],
+               "modify": [{"m": "1"}, {"m": "2"}],
+               "id": "c-{x}-{y}-{m}"}]
+    spill, spilled_files = SpillableList.spill, []
+
+    def spill_and_check(self):
+        spill(self)
+        spilled_files.append(os.path.getsize(self.runs[-1]))
+    SpillableList.spill = spill_and_check
+    try:
+        budgeted_entries = execute_schema(schema, [{}], {}, memory_budget=10000)
+    finally:
+        SpillableList.spill = spill
+    assert len(spilled_files) > 0 and all([size > 0 for size in spilled_files])
+    assert len(budgeted_entries) == 200 + 100 * 100 * 2
+    assert budgeted_entries == execute_schema(schema, [{}], {})
+
+    # Check merging snapshots
+    schema = [{"modify": [{"n": "1", "x@default": "a"}, {"n": "2", "y": "b"}], "id": "e{n}"},
+              {"modify": [{"n": "1", "x": "b"}, {"n": "3"}], "id": "e{n}"},
+              {"modify": [{"n": "2", "y": "c", "z@default": "d"}], "id": "e{n}"}]
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filenames = []
+        for i, action in enumerate(schema):
+            filenames.append(os.path.join(tmpdir, f"{i}.snapshot"))
+            with open(filenames[-1], 'wt') as f:
+                for id, entry in sorted(execute_schema_by_id([action], {}).items()):
+                    f.write(json.dumps({'id': id, 'entry': entry}) + "\n")
+        merged_filename = os.path.join(tmpdir, "merged.snapshot")
+        with open(merged_filename, 'wt') as f:
+            merge_snapshots(filenames, f)
+        assert (execute_schema_by_id(get_schema_from_json([merged_filename]), {}) ==
+                dict(sorted(execute_schema_by_id(schema, {}).items())))
+
 
 if __name__ == "__main__":
     if len(sys.argv) >= 2 and sys.argv[1] == '--test':
@@ -0,0 +1,304 @@
+#!/usr/bin/env python
+"""
+Harvest the runtime of the finished chroma jobs and recommend the size of new jobs.
+
+The scripts created by `create_chroma_job.py` have the resources requested in a line `#KAON_BATCH`
+and the class of the job, eg. `eigs <ensemble>`, in a line `#KAON_JOB`; and the jobs write the
+epochs of their start and end in the output file. The runtimes are collected from the jobs under
+the run directory that `kaon-get-slurm-status.sh` verified, and stored in a table by facility, job
+class, and script, so that harvesting twice the same jobs has no effect.
+
+From the table, the maximum time of a job is a high quantile of the runtimes with the same number
+of nodes plus a margin, and the number of nodes is the one with the fewest node-hours per job.
+"""
+
+import argparse
+import json
+import math
+import os
+import re
+import sys
+import tempfile
+
+# Minimum number of successful jobs with the same number of nodes to make a recommendation
+MIN_SAMPLES = 3
+
+# Quantile of the runtimes and extra fraction of time used for the maximum time of a job
+RUNTIME_QUANTILE = 0.95
+RUNTIME_MARGIN = 0.25
+
+# Bounds on the recommended maximum time in seconds, and granularity
+MIN_MAXTIME = 10 * 60
+MAXTIME_STEP = 5 * 60
+
+#
+# Harvesting
+#
+
+
+def parse_slurm_time(value):
+    """
+    Return the number of seconds in a SLURM time like 30, 30:00, 8:00:00, or 1-00:00:00.
+    """
+
+    days, _, value = value.rpartition('-')
+    fields = [int(x) for x in value.split(':')]
+    if len(fields) == 1:
+        fields = [0, fields[0], 0]
+    elif len(fields) == 2:
+        fields = [0] + fields
+    return ((int(days or 0) * 24 + fields[0]) * 60 + fields[1]) * 60 + fields[2]
+
+
+def format_slurm_time(seconds):
+    """
+    Return the seconds as a SLURM time, H:MM:SS.
+    """
+
+    return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+def read_job(base):
+    """
+    Return the job class, the number of nodes, and the runtime in seconds of a verified job from
+    the files `<base>.sh`, `<base>.out`, and `<base>.verified`. The runtime is None if the job
+    failed. Return None if the job isn't described.
+    """
+
+    job_class, nodes = None, None
+    with open(f"{base}.sh", 'rt') as f:
+        for line in f:
+            if line.startswith("#KAON_JOB "):
+                job_class = line[len("#KAON_JOB "):].strip()
+            elif line.startswith("#KAON_BATCH "):
+                m = re.search(r"--nodes[= ](\d+)", line)
+                nodes = m and m.group(1)
+    if not job_class or not nodes:
+        return None
+
+    with open(f"{base}.verified", 'rt') as f:
+        if f.read().strip() != "success":
+            return job_class, nodes, None
+    start, end = None, None
+    if os.path.exists(f"{base}.out"):
+        with open(f"{base}.out", 'rt', errors='replace') as f:
+            for line in f:
+                m = re.match(r"(RUNNING|FINISHED) chroma (\d+)", line)
+                if m and m.group(1) == "RUNNING":
+                    start = int(m.group(2))
+                elif m:
+                    end = int(m.group(2))
+    if start is None or end is None:
+        return None
+    return job_class, nodes, end - start
+
+
+def harvest(table, facility, local_run):
+    """
+    Add to the table the jobs verified under the run directory. Return the number of jobs added.
+    """
+
+    num_jobs = 0
+    for root, _, filenames in os.walk(local_run):
+        for filename in filenames:
+            if not filename.endswith(".verified"):
+                continue
+            base = os.path.join(root, filename[:-len(".verified")])
+            try:
+                job = read_job(base)
+            except FileNotFoundError:
+                continue
+            if job is None:
+                continue
+            job_class, nodes, seconds = job
+            jobs = table.setdefault(facility, {}).setdefault(job_class, {})
+            if base not in jobs:
+                num_jobs += 1
+            jobs[base] = [nodes, seconds]
+    return num_jobs
+
+
+#
+# Table
+#
+
+
+def read_table(filename):
+    """
+    Return the runtime table, a dictionary from facility to job class to script to a pair with the
+    number of nodes and the runtime in seconds, or null if the job failed.
+    """
+
+    if not os.path.exists(filename):
+        return {}
+    with open(filename, 'rt') as f:
+        return json.load(f)
+
+
+def write_table(table, filename):
+    """
+    Store the table; the file is replaced atomically.
+    """
+
+    with open(f"{filename}.tmp", 'wt') as f:
+        json.dump(table, f, indent=4, sort_keys=True)
+    os.replace(f"{filename}.tmp", filename)
+
+
+def get_quantile(values, q):
+    """
+    Return the q-quantile of the values, taking the closest value from above.
+    """
+
+    values = sorted(values)
+    return values[min(int(math.ceil(q * len(values))) - 1, len(values) - 1)]
+
+
+def get_runtime_stats(table, facility, job_class):
+    """
+    Return a dictionary from number of nodes to a dictionary with the number of successful jobs,
+    `count`, the number of failed jobs, `failed`, and the median and the quantile of the runtime,
+    `median` and `quantile`.
+    """
+
+    by_nodes = {}
+    for nodes, seconds in table.get(facility, {}).get(job_class, {}).values():
+        by_nodes.setdefault(nodes, []).append(seconds)
+    stats = {}
+    for nodes, runtimes in by_nodes.items():
+        ok = [s for s in runtimes if s is not None]
+        stats[nodes] = {
+            'count': len(ok),
+            'failed': len(runtimes) - len(ok),
+            'median': get_quantile(ok, 0.5) if ok else None,
+            'quantile': get_quantile(ok, RUNTIME_QUANTILE) if ok else None
+        }
+    return stats
+
+
+def recommend(table, facility, job_class, nodes, maxtime, procs=None, cores_per_node=None):
+    """
+    Return the number of nodes and the maximum time for a job, given the ones set up by hand. If
+    the number of processes of the job is given, only numbers of nodes running the same number of
+    processes each, and at least a core per process if `cores_per_node` is given, are recommended.
+    """
+
+    def is_compatible(n):
+        return procs is None or (procs % int(n) == 0 and
+                                 (cores_per_node is None or cores_per_node * int(n) >= procs))
+
+    stats = {n: s for n, s in get_runtime_stats(table, facility, job_class).items()
+             if s['count'] >= MIN_SAMPLES and is_compatible(n)}
+    if not stats:
+        return nodes, maxtime
+
+    # Take the number of nodes with the fewest node-hours per job
+    nodes = min(stats.keys(), key=lambda n: (int(n) * stats[n]['median'], int(n)))
+
+    # Failed jobs may have hit the time limit, so don't shorten it then
+    s = stats[nodes]
+    seconds = int(s['quantile'] * (1 + RUNTIME_MARGIN))
+    seconds = max(int(math.ceil(seconds / MAXTIME_STEP)) * MAXTIME_STEP, MIN_MAXTIME)
+    if s['failed'] > 0:
+        seconds = max(seconds, parse_slurm_time(maxtime))
+    return nodes, format_slurm_time(seconds)
+
+
+def process_args():
+    """
+    Parser commandline arguments and do the thing
+    """
+
+    parser = argparse.ArgumentParser(
+        description="Add the runtimes of the finished jobs to the runtime table and print it")
+    parser.add_argument("--table", default=None,
+                        help="file with the runtime table; by default "
+                        "$LOCAL_RUN/.runtime-table.json")
+    parser.add_argument("--facility", default=os.environ.get("THIS_FACILITY"),
+                        help="facility running the jobs; by default $THIS_FACILITY")
+    parser.add_argument("--no-harvest", action='store_true', default=False,
+                        help="only print the table")
+    args = parser.parse_args()
+
+    local_run = os.environ.get("LOCAL_RUN", "run")
+    table_filename = args.table or os.path.join(local_run, ".runtime-table.json")
+    table = read_table(table_filename)
+    if not args.no_harvest:
+        if not args.facility:
+            parser.error("please set up THIS_FACILITY or give --facility")
+        num_jobs = harvest(table, args.facility, local_run)
+        os.makedirs(os.path.dirname(table_filename) or ".", exist_ok=True)
+        write_table(table, table_filename)
+        sys.stderr.write(f"Added {num_jobs} job(s)\n")
+
+    for facility in sorted(table.keys()):
+        for job_class in sorted(table[facility].keys()):
+            stats = get_runtime_stats(table, facility, job_class)
+            for nodes in sorted(stats.keys(), key=int):
+                s = stats[nodes]
+                median = format_slurm_time(s['median']) if s['median'] is not None else "_null_"
+                sys.stdout.write(f"{facility} {job_class} nodes={nodes} ok={s['count']} "
+                                 f"failed={s['failed']} median={median}\n")
+
+
+def do_test():
+    """
+    Minimal tests.
+    """
+
+    assert parse_slurm_time("30") == 30 * 60
+    assert parse_slurm_time("30:05") == 30 * 60 + 5
+    assert parse_slurm_time("8:00:00") == 8 * 3600
+    assert parse_slurm_time("1-02:00:00") == 26 * 3600
+    assert format_slurm_time(26 * 3600 + 65) == "26:01:05"
+
+    with tempfile.TemporaryDirectory() as local_run:
+        def write_job(name, nodes, verified, out):
+            base = os.path.join(local_run, name)
+            with open(f"{base}.sh", 'wt') as f:
+                f.write(f"#!/bin/bash\n#KAON_BATCH -t 1:00:00 --nodes={nodes} -n 8 \n"
+                        "#KAON_JOB eigs e\n")
+            with open(f"{base}.verified", 'wt') as f:
+                f.write(verified + "\n")
+            if out is not None:
+                with open(f"{base}.out", 'wt') as f:
+                    f.write(out)
+            return base
+
+        # Only the jobs verified and described are read
+        ok = write_job("ok", 2, "success", "RUNNING chroma 100\nlog\nFINISHED chroma 700\n")
+        failed = write_job("failed", 2, "fail", "RUNNING chroma 100\n")
+        write_job("unfinished", 2, "success", "RUNNING chroma 100\n")
+        with open(os.path.join(local_run, "other.sh"), 'wt') as f:
+            f.write("#!/bin/bash\n")
+        assert read_job(ok) == ("eigs e", "2", 600)
+        assert read_job(failed) == ("eigs e", "2", None)
+        assert read_job(os.path.join(local_run, "unfinished")) is None
+        table = {}
+        assert harvest(table, "f", local_run) == 2
+        assert harvest(table, "f", local_run) == 0
+        assert table == {"f": {"eigs e": {ok: ["2", 600], failed: ["2", None]}}}
+
+    # The number of nodes is the one with the fewest node-hours, and the maximum time is enough
+    # for the slowest jobs plus a margin
+    table = {"f": {"eigs e": dict(
+        [(f"a{i}", ["1", 3000]) for i in range(3)] + [(f"b{i}", ["2", 1000]) for i in range(3)] +
+        [(f"c{i}", ["8", 200]) for i in range(2)] + [(f"d{i}", ["4", 400]) for i in range(3)])}}
+    assert recommend(table, "f", "eigs e", "1", "2:00:00") == ("4", "0:10:00")
+    assert recommend(table, "f", "eigs g", "1", "2:00:00") == ("1", "2:00:00")
+    # Only the numbers of nodes compatible with the processes of the job
+    assert recommend(table, "f", "eigs e", "1", "2:00:00", procs=6) == ("2", "0:25:00")
+    assert recommend(table, "f", "eigs e", "1", "2:00:00", procs=8,
+                     cores_per_node=2) == ("4", "0:10:00")
+    assert recommend(table, "f", "eigs e", "1", "2:00:00", procs=8,
+                     cores_per_node=1) == ("1", "2:00:00")
+    # Failed jobs keep the maximum time set up by hand
+    table["f"]["eigs e"]["d3"] = ["4", None]
+    assert recommend(table, "f", "eigs e", "1", "2:00:00") == ("4", "2:00:00")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 2 and sys.argv[1] == '--test':
+        do_test()
+    else:
+        process_args()
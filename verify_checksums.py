@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+"""
+Verify the integrity of files in the local cache.
+
+The reference digest of a file is kept in a sidecar file `<file>.sha256` with the format of
+`sha256sum`. For each file the script prints a line with the path relative to the local cache and
+one of the following statuses:
+- verified, the digest of the file matches the sidecar;
+- corrupted, the digest of the file doesn't match the sidecar;
+- unverified, there's no sidecar for the file;
+- sidecar-created, with `--write`, there was no sidecar for the file and one was created.
+Files found under the given directories that are being copied here or were just modified aren't
+reported. The sidecars should be created with `--write` only by the producer of the files, eg.
+for the eigenvectors computed here, because a corrupted copy would be taken as good; the
+configurations have no sidecar unless one was copied along with them.
+
+Files are hashed concurrently with large sequential reads. The digests are cached in the local
+cache keyed by path, size, and modification time, so that unchanged files are never read again.
+"""
+
+import argparse
+import concurrent.futures
+import fcntl
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time
+
+# Size of each read when hashing a file
+READ_SIZE = 16 * 1024 * 1024
+
+# Suffix of the files with the reference digest
+SIDECAR_SUFFIX = ".sha256"
+
+# Suffixes of the files in the cache that aren't artifacts, besides the Globus track files
+IGNORED_SUFFIXES = (SIDECAR_SUFFIX, ".tmp")
+
+# Suffix of the track of a file being copied into this facility, see globus_transfer.py
+INCOMING_TRACK_SUFFIX = ".globus-to-here"
+
+
+def hash_file(path):
+    """
+    Return the SHA-256 hexadecimal digest of the file.
+    """
+
+    h = hashlib.sha256()
+    buf = bytearray(READ_SIZE)
+    view = memoryview(buf)
+    with open(path, 'rb', buffering=0) as f:
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            h.update(view[:n])
+    return h.hexdigest()
+
+
+def read_sidecar(path):
+    """
+    Return the reference digest of the file or None if there's no sidecar.
+    """
+
+    try:
+        with open(path + SIDECAR_SUFFIX, 'rt') as f:
+            line_elems = f.readline().split()
+    except FileNotFoundError:
+        return None
+    return line_elems[0].lower() if line_elems else None
+
+
+def write_sidecar(path, digest):
+    """
+    Write the reference digest of the file; the file is replaced atomically.
+    """
+
+    with open(f"{path}{SIDECAR_SUFFIX}.tmp", 'wt') as f:
+        f.write(f"{digest}  {os.path.basename(path)}\n")
+    os.replace(f"{path}{SIDECAR_SUFFIX}.tmp", path + SIDECAR_SUFFIX)
+
+
+#
+# Digest cache
+#
+
+
+def get_cache_key(path):
+    """
+    Return the values that invalidate a cached digest when the file changes.
+    """
+
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+
+def read_digest_cache(filename):
+    """
+    Return the digest cache, a dictionary from path to (size, mtime, digest).
+    """
+
+    if not os.path.exists(filename):
+        return {}
+    with open(filename, 'rt') as f:
+        return json.load(f)
+
+
+def update_digest_cache(filename, new_digests):
+    """
+    Add the new digests to the cache. Other processes may update the cache at the same time, so
+    the cache is read again and replaced atomically while holding a lock.
+    """
+
+    if not new_digests:
+        return
+    os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
+    with open(f"{filename}.lock", 'wt') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        cache = read_digest_cache(filename)
+        cache.update(new_digests)
+        with open(f"{filename}.tmp", 'wt') as f:
+            json.dump(cache, f)
+        os.replace(f"{filename}.tmp", filename)
+
+
+#
+# Verification
+#
+
+
+def get_files(local_cache, dirs, min_age):
+    """
+    Return the files under the given directories relative to the local cache. Files being copied
+    into this facility or modified in the last `min_age` seconds, eg. by a running job, are left
+    out, so they aren't hashed while they change.
+    """
+
+    now = time.time()
+    for d in dirs:
+        for root, _, filenames in os.walk(os.path.join(local_cache, d)):
+            names = set(filenames)
+            for filename in sorted(filenames):
+                if ".globus-to-" in filename or filename.endswith(IGNORED_SUFFIXES) or \
+                        filename + INCOMING_TRACK_SUFFIX in names:
+                    continue
+                path = os.path.join(root, filename)
+                try:
+                    if now - os.path.getmtime(path) < min_age:
+                        continue
+                except FileNotFoundError:
+                    continue
+                yield os.path.relpath(path, local_cache)
+
+
+def verify_files(files, local_cache, digest_cache_filename, jobs, write):
+    """
+    Return a list of (file, status) for the given files relative to the local cache. If `write`,
+    create the missing sidecars; the digest of these files isn't checked against anything, so
+    they are reported as `sidecar-created` instead of `verified`.
+    """
+
+    digest_cache = read_digest_cache(digest_cache_filename)
+    new_digests = {}
+
+    def get_digest(filename):
+        path = os.path.join(local_cache, filename)
+        key = get_cache_key(path)
+        cached = digest_cache.get(filename)
+        if cached and cached[:2] == key:
+            return cached[2]
+        digest = hash_file(path)
+        new_digests[filename] = key + [digest]
+        return digest
+
+    def verify(filename):
+        path = os.path.join(local_cache, filename)
+        reference = read_sidecar(path)
+        if reference is None and not write:
+            return filename, "unverified"
+        digest = get_digest(filename)
+        if reference is None:
+            write_sidecar(path, digest)
+            return filename, "sidecar-created"
+        return filename, "verified" if digest == reference else "corrupted"
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+            return list(executor.map(verify, files))
+    finally:
+        update_digest_cache(digest_cache_filename, new_digests)
+
+
+def process_args():
+    """
+    Parser commandline arguments and do the thing
+    """
+
+    parser = argparse.ArgumentParser(
+        description="Verify the files under the given directories or the files given from the "
+        "standard input, all of them relative to the local cache")
+    parser.add_argument("dirs", metavar='dir', nargs='*',
+                        help="directories relative to the local cache")
+    parser.add_argument("--cache", default=os.environ.get("LOCAL_CACHE", "cache"),
+                        help="local cache directory; by default $LOCAL_CACHE")
+    parser.add_argument("--digest-cache", default=None,
+                        help="file caching the digests; by default <cache>/.checksum-cache.json")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(),
+                        help="maximum number of files hashed at the same time")
+    parser.add_argument("--min-age", type=float, default=600,
+                        help="seconds since the last modification of a file found under the "
+                        "directories before hashing it")
+    parser.add_argument("--write", action='store_true', default=False,
+                        help="create the sidecar of the files without one; use it only on files "
+                        "produced here")
+    args = parser.parse_args()
+
+    if args.dirs:
+        files = list(get_files(args.cache, args.dirs, args.min_age))
+    else:
+        files = [line.split()[0] for line in sys.stdin if line.split()]
+    digest_cache_filename = args.digest_cache or os.path.join(args.cache, ".checksum-cache.json")
+    for filename, status in verify_files(files, args.cache, digest_cache_filename, args.jobs,
+                                         args.write):
+        sys.stdout.write(f"{filename} {status}\n")
+
+
+def do_test():
+    """
+    Minimal tests.
+    """
+
+    with tempfile.TemporaryDirectory() as local_cache:
+        digest_cache_filename = os.path.join(local_cache, ".checksum-cache.json")
+        now = time.time()
+
+        def write(filename, content, age=3600):
+            path = os.path.join(local_cache, filename)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wt') as f:
+                f.write(content)
+            mtime = now - age
+            os.utime(path, (mtime, mtime))
+
+        def verify(files, write=False):
+            return dict(verify_files(files, local_cache, digest_cache_filename, 2, write))
+
+        # Files being copied here, just modified, or that aren't artifacts are skipped
+        for filename in ("d/a", "d/b", "d/c", "d/c.globus-to-here", "d/d.globus-to-jlab",
+                         "d/e.tmp", "d/a.sha256.tmp"):
+            write(filename, "x")
+        write("d/new", "x", age=0)
+        write("e/f", "x")
+        assert list(get_files(local_cache, ["d"], 600)) == ["d/a", "d/b"]
+
+        # The sidecars are compared with the files, and created only with `write`
+        write_sidecar(os.path.join(local_cache, "d/a"), hash_file(os.path.join(local_cache,
+                                                                                "d/a")))
+        write("d/b.sha256", "0" * 64 + "  b\n")
+        assert verify(["d/a", "d/b", "e/f"]) == {"d/a": "verified", "d/b": "corrupted",
+                                                 "e/f": "unverified"}
+        assert verify(["e/f"], write=True) == {"e/f": "sidecar-created"}
+        assert read_sidecar(os.path.join(local_cache, "e/f")) == hashlib.sha256(b"x").hexdigest()
+        assert verify(["e/f"]) == {"e/f": "verified"}
+
+        # The cached digest is used while the size and the modification time don't change
+        assert set(read_digest_cache(digest_cache_filename).keys()) == {"d/a", "d/b", "e/f"}
+        write("d/a", "y")
+        assert verify(["d/a"]) == {"d/a": "verified"}
+        write("d/a", "y", age=60)
+        assert verify(["d/a"]) == {"d/a": "corrupted"}
+        write("d/a", "xx")
+        assert verify(["d/a"]) == {"d/a": "corrupted"}
+        write("d/a", "x")
+        assert verify(["d/a"]) == {"d/a": "verified"}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 2 and sys.argv[1] == '--test':
+        do_test()
+    else:
+        process_args()
@@ -0,0 +1,453 @@
+#!/usr/bin/env python
+"""
+Run the workflow computing the missing eigenvectors.
+
+At each cycle the scope is evaluated once, and the work set of each stage is taken from the
+resulting entries with a view, like the queries `kaon.py ... --show ...`. The stages are run
+concurrently, except the ones sharing a resource, eg. the Globus ledger. A stage is skipped if its
+work set didn't change since it last finished successfully, unless that was long ago. The next
+cycle starts sooner when the entries relevant to the stages changed, and later when they didn't.
+"""
+
+import argparse
+import concurrent.futures
+import contextlib
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import kaon
+from create_chroma_job import get_facility
+
+# Stages of the workflow. Each stage has:
+# - view: constrains on the entries of the scope, as in the commandline of kaon.py, but the entries
+#   must have all the properties in the view;
+# - show: properties to output, as in `kaon.py --show`;
+# - output-format: format of the output, as in `kaon.py --output-format`;
+# - command: the command reading the work set from the standard input;
+# - resource: stages with the same resource don't run at the same time;
+# - batch-size: if given, the work set is split into batches of that many lines;
+# - max-concurrency: maximum number of batches of the stage running at the same time;
+# - rerun-after: if given, overrides --rerun-after for the stage.
+# Stages without a view run the command without input.
+# The values can refer to THIS_FACILITY, node_type, max_promises, and max_eig_promises.
+STAGES = [
+    {
+        'name': 'Copy back configurations that are not at JLab',
+        'view': {'cfg_file_remote_status': ['promised', 'none'], 'cfg_file_status': ['local']},
+        'show': ['cfg_file'],
+        'command': ['./kaon-remote-cp.sh', 'here', 'jlab'],
+        'resource': 'globus'
+    },
+    {
+        'name': 'Record checksums of eigenvectors computed here',
+        'view': {'eig_file_promiser': ['{THIS_FACILITY}'], 'eig_file_status': ['local'],
+                 'eig_file_checksum_status': ['unverified']},
+        'show': ['eig_file'],
+        'command': ['./verify_checksums.py', '--write'],
+        'resource': 'checksums'
+    },
+    {
+        'name': 'Copy back eigenvectors that are not at JLab',
+        'view': {'eig_file_remote_status': ['promised', 'none'], 'eig_file_status': ['local'],
+                 'eig_file_checksum_status': ['verified']},
+        'show': ['eig_file'],
+        'command': ['./kaon-remote-cp.sh', 'here', 'jlab'],
+        'resource': 'globus'
+    },
+    {
+        'name': 'Remove promises for local eigenvectors at JLab',
+        'view': {'eig_file_remote_status': ['promised'], 'eig_file_promiser': ['{THIS_FACILITY}'],
+                 'eig_file_status': ['local'], 'eig_file_checksum_status': ['verified']},
+        'show': ['eig_file'],
+        'command': ['./kaon-rm-promise.sh', '{THIS_FACILITY}'],
+        'resource': 'promises',
+        'batch-size': 1000,
+        'max-concurrency': 2
+    },
+    {
+        'name': 'Promise eigenvectors to compute',
+        'view': {'eig_file_remote_status': ['none'], 'eig_file_status': ['none']},
+        'show': ['eig_file'],
+        'command': ['./kaon-promise.sh', '{THIS_FACILITY}'],
+        'resource': 'promises',
+        'limit': 'free_eig_promises',
+        'batch-size': 1000,
+        'max-concurrency': 2
+    },
+    {
+        'name': 'Bring from tape configurations for promised eigenvectors',
+        'view': {'cfg_file_remote_status': ['tape'], 'cfg_file_status': ['none'],
+                 'eig_file_remote_status': ['promised'], 'eig_file_promiser': ['{THIS_FACILITY}'],
+                 'eig_file_status': ['none']},
+        'show': ['cfg_file'],
+        'command': ['./kaon-get-from-tape-remote.sh', '{max_promises}'],
+        'resource': 'tape'
+    },
+    {
+        'name': 'Bring to this facility configurations for promised eigenvectors',
+        'view': {'cfg_file_remote_status': ['cached'], 'cfg_file_status': ['none'],
+                 'eig_file_remote_status': ['promised'], 'eig_file_promiser': ['{THIS_FACILITY}'],
+                 'eig_file_status': ['none']},
+        'show': ['cfg_file'],
+        'command': ['./kaon-remote-cp.sh', 'jlab', 'here'],
+        'resource': 'globus'
+    },
+    {
+        'name': 'Create jobs computing the promised eigenvectors',
+        'view': {'kind': ['eigenvector'], 'cfg_file_status': ['local'],
+                 'eig_file_remote_status': ['promised'], 'eig_file_promiser': ['{THIS_FACILITY}'],
+                 'eig_file_status': ['none']},
+        'show': ['eig_default_run', 'ens_name', 'cfg_file', 'smear_fact', 'smear_num',
+                 'default_num_vecs', 'eig_default_file', 'space_size', 'time_size',
+                 'eig_{node_type}_geom', 'eig_{node_type}_num_nodes', 'eig_{node_type}_maxtime'],
+        'output-format': 'schema',
+        'command': ['./kaon-create-jobs-eigs.sh'],
+        'resource': 'jobs'
+    },
+    {
+        'name': 'Compact the logs of promises',
+        'command': ['./kaon-compact-promises.sh'],
+        'resource': 'promises',
+        'rerun-after': '24h'
+    }
+]
+
+
+def log(msg):
+    sys.stderr.write(f"{time.strftime('%Y-%m-%d %H:%M:%S')} {msg}\n")
+    sys.stderr.flush()
+
+
+def get_params(facility_name):
+    """
+    Return the values that the stages may refer to.
+    """
+
+    facility = get_facility(facility_name)
+    max_promises = int(facility.get('max_promises', 0))
+    return {
+        'THIS_FACILITY': facility_name,
+        'node_type': facility.get('node_type', ''),
+        'max_promises': max_promises,
+        'max_eig_promises': max_promises if facility.get('do_eigs') == 'yes' else 0
+    }
+
+
+def get_facility_goals(constrains, facility_name, facilities_file="facilities.json"):
+    """
+    Return the constrains restricted to the ensembles active in the facility.
+    """
+
+    facilities_schema = kaon.get_schema_from_json([facilities_file])
+    ensembles = set([entry['ens_name'] for entry in
+                     kaon.execute_schema(facilities_schema, [{'facility': {facility_name}}], {})
+                     if entry.get('facility') == facility_name and 'ens_name' in entry])
+    return kaon.get_constrained_view(constrains, {'ens_name': ensembles})
+
+
+def get_env(schema):
+    """
+    Return the values of the variables in the schema from the environ or their defaults.
+    """
+
+    env = {}
+    for k, default, _ in kaon.get_variables_from_schema(schema):
+        if k not in os.environ and default is None:
+            raise Exception(f"Please set up the environ variable {k}")
+        env[k] = os.environ.get(k, default)
+    return env
+
+
+def format_artifacts(artifacts, output_attributes, output_format):
+    """
+    Return the output of kaon.py printing the artifacts.
+    """
+
+    f = io.StringIO()
+    with contextlib.redirect_stdout(f):
+        if output_format == 'schema':
+            kaon.print_artifacts_as_schema(artifacts, output_attributes)
+        else:
+            kaon.print_artifacts_as_table(artifacts, output_attributes, False, ' ')
+    return f.getvalue()
+
+
+def get_stage_show(stage, params):
+    """
+    Return the properties shown by the stage.
+    """
+
+    return [k.format(**params) for k in stage['show']]
+
+
+def get_stage_artifacts(artifacts, stage, constrains, params):
+    """
+    Return the artifacts in the view of the stage restricted to the shown properties. Unlike
+    kaon.py, artifacts without some property of the view are left out.
+    """
+
+    view = {k: kaon.normalize_value_constrain([v.format(**params) for v in values])
+            for k, values in stage['view'].items()}
+    constrained_view = kaon.get_constrained_view(constrains, view)
+    return kaon.restrict_output_attributes(
+        [a for a in artifacts if all([k in a for k in view]) and
+         kaon.is_entry_in_constrained_view(a, constrained_view)],
+        get_stage_show(stage, params))
+
+
+def get_work_sets(artifacts, constrains, params):
+    """
+    Return the input for the command of each stage.
+    """
+
+    # Limit the number of promises to the ones left
+    promised = get_stage_artifacts(artifacts, {'view': {'eig_file_promiser': ['{THIS_FACILITY}']},
+                                               'show': ['eig_file']}, constrains, params)
+    limits = {'free_eig_promises': max(params['max_eig_promises'] - len(promised), 0)}
+
+    work_sets = []
+    for stage in STAGES:
+        if 'view' not in stage:
+            work_sets.append([""])
+            continue
+        stage_artifacts = get_stage_artifacts(artifacts, stage, constrains, params)
+        if 'limit' in stage:
+            stage_artifacts = stage_artifacts[:limits[stage['limit']]]
+        if stage.get('output-format', 'table') == 'schema':
+            batches = [stage_artifacts] if stage_artifacts else []
+        else:
+            batch_size = stage.get('batch-size') or max(len(stage_artifacts), 1)
+            batches = [stage_artifacts[i:i + batch_size]
+                       for i in range(0, len(stage_artifacts), batch_size)]
+        work_sets.append([format_artifacts(batch, get_stage_show(stage, params),
+                                           stage.get('output-format', 'table'))
+                          for batch in batches])
+    return work_sets
+
+
+def run_stage(stage, batches, params, resource_locks, dry_run):
+    """
+    Run the command of the stage on each batch of its work set. Return whether all succeeded.
+    """
+
+    command = [arg.format(**params) for arg in stage['command']]
+    if dry_run:
+        for batch in batches:
+            sys.stdout.write(f"# {stage['name']}: {' '.join(command)}\n{batch}")
+        return True
+
+    def run_batch(batch):
+        r = subprocess.run(command, input=batch, universal_newlines=True)
+        if r.returncode != 0:
+            log(f"`{stage['name']}` failed with exit code {r.returncode}")
+        return r.returncode == 0
+
+    with resource_locks.setdefault(stage.get('resource', stage['name']), threading.Lock()):
+        log(f"Running `{stage['name']}` on {sum([len(b.splitlines()) for b in batches])} "
+            f"line(s) in {len(batches)} batch(es)")
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=stage.get('max-concurrency', 1)) as executor:
+            return all(list(executor.map(run_batch, batches)))
+
+
+def get_relevant_artifacts(artifacts_by_id, params):
+    """
+    Return the artifacts restricted to the properties that the stages look at.
+    """
+
+    props = set([k for stage in STAGES if 'view' in stage
+                 for k in list(stage['view'].keys()) + get_stage_show(stage, params)])
+    return {id: {k: v for k, v in artifact.items() if k in props}
+            for id, artifact in artifacts_by_id.items()}
+
+
+def run_workflow(schema, constrains, env, params, min_interval, max_interval, rerun_after,
+                 jobs, once, dry_run):
+    """
+    Run cycles of evaluating the scope and running the stages.
+    """
+
+    resource_locks = {}
+    last_runs = {}  # stage index -> (work set, time of the last successful run)
+    old_artifacts = None
+    interval = min_interval
+    while True:
+        start = time.time()
+        try:
+            artifacts_by_id = {id: artifact for id, artifact in
+                               kaon.execute_schema_by_id(schema, env, jobs=jobs).items()
+                               if kaon.is_entry_in_constrained_view(artifact, constrains or [{}])}
+            work_sets = get_work_sets(list(artifacts_by_id.values()), constrains, params)
+        except Exception as e:
+            log(f"Error evaluating the scope: {e}")
+            artifacts_by_id, work_sets = None, None
+
+        if artifacts_by_id is not None:
+            # Decide when to run the next cycle from the changes since the last one
+            artifacts = get_relevant_artifacts(artifacts_by_id, params)
+            changes = (kaon.get_artifacts_changes(old_artifacts, artifacts)
+                       if old_artifacts is not None else [])
+            old_artifacts = artifacts
+            interval = min_interval if changes else min(interval * 2, max_interval)
+            log(f"Evaluated {len(artifacts_by_id)} entries with {len(changes)} change(s) in "
+                f"{time.time() - start:.0f}s")
+
+            # Run the stages with new work or that ran long ago
+            futures = {}
+            with concurrent.futures.ThreadPoolExecutor(max_workers=len(STAGES)) as executor:
+                for i, (stage, batches) in enumerate(zip(STAGES, work_sets)):
+                    if not batches:
+                        continue
+                    stage_rerun_after = kaon.parse_interval(stage['rerun-after']) \
+                        if 'rerun-after' in stage else rerun_after
+                    if i in last_runs and last_runs[i][0] == batches and \
+                            time.time() - last_runs[i][1] < stage_rerun_after:
+                        continue
+                    futures[i] = executor.submit(run_stage, stage, batches, params,
+                                                 resource_locks, dry_run)
+                for i, f in futures.items():
+                    try:
+                        if f.result():
+                            last_runs[i] = (work_sets[i], time.time())
+                    except Exception as e:
+                        log(f"Error running `{STAGES[i]['name']}`: {e}")
+
+        if once:
+            break
+        log(f"Next cycle in {interval:.0f}s")
+        time.sleep(interval)
+
+
+def process_args():
+    """
+    Parser commandline arguments and do the thing
+    """
+
+    parser = argparse.ArgumentParser(description="Run the workflow computing the missing "
+                                     "eigenvectors at this facility")
+    parser.add_argument("inputs", metavar='file', nargs='*',
+                        default=["facilities.json", "ensembles.json", "streams.json",
+                                 "artifacts.json"],
+                        help="KaoN schema files describing the scope")
+    parser.add_argument("--constrains", nargs='+', default=["goals.json"],
+                        help="JSON files with a list of constrains; they are restricted to the "
+                        "ensembles active in this facility")
+    parser.add_argument("--facility", default=os.environ.get("THIS_FACILITY"),
+                        help="this facility; by default $THIS_FACILITY")
+    parser.add_argument("--min-interval", type=kaon.parse_interval, default="5m",
+                        help="time between cycles when the entries change, eg. 5m")
+    parser.add_argument("--max-interval", type=kaon.parse_interval, default="30m",
+                        help="maximum time between cycles when the entries don't change, eg. 30m")
+    parser.add_argument("--rerun-after", type=kaon.parse_interval, default="30m",
+                        help="run a stage again after that time even if its work set didn't "
+                        "change, eg. 30m")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="maximum number of processes executing the actions with \"shard-by\"")
+    parser.add_argument("--once", action='store_true', default=False,
+                        help="run a single cycle")
+    parser.add_argument("--dry-run", action='store_true', default=False,
+                        help="print the work set of each stage instead of running the commands")
+    args = parser.parse_args()
+
+    if not args.facility:
+        parser.error("please set up THIS_FACILITY or give --facility")
+    schema = kaon.get_schema_from_json(args.inputs)
+    constrains = get_facility_goals(kaon.get_constrains_from_json(args.constrains), args.facility)
+    run_workflow(schema, constrains, get_env(schema), get_params(args.facility),
+                 args.min_interval, args.max_interval, args.rerun_after, args.jobs, args.once,
+                 args.dry_run)
+
+
+def do_test():
+    """
+    Minimal tests with stages and a scope made up for the tests.
+    """
+
+    global STAGES
+
+    artifacts = [
+        {'kind': 'eigenvector', 'eig_file': 'f1', 'eig_file_status': 'none',
+         'eig_file_promiser': 'here'},
+        {'kind': 'eigenvector', 'eig_file': 'f2', 'eig_file_status': 'none',
+         'eig_file_promiser': 'other'},
+        {'kind': 'eigenvector', 'eig_file': 'f3', 'eig_file_status': 'none'},
+        {'kind': 'eigenvector', 'eig_file': 'f4', 'eig_file_status': 'local',
+         'eig_file_promiser': 'here'},
+        {'kind': 'configuration', 'cfg_file': 'c1'}]
+    params = {'THIS_FACILITY': 'here', 'node_type': '', 'max_promises': 3, 'max_eig_promises': 3}
+    stages = [
+        {'name': 'promise', 'view': {'eig_file_status': ['none']}, 'show': ['eig_file'],
+         'command': ['true'], 'limit': 'free_eig_promises'},
+        {'name': 'copy', 'view': {'eig_file_status': ['none'],
+                                  'eig_file_promiser': ['{THIS_FACILITY}', 'other']},
+         'show': ['eig_file'], 'command': ['true'], 'batch-size': 1},
+        {'name': 'jobs', 'view': {'kind': ['eigenvector'], 'eig_file_status': ['local']},
+         'show': ['eig_file'], 'output-format': 'schema', 'command': ['true']},
+        {'name': 'compact', 'command': ['true']}]
+    old_stages = STAGES
+    STAGES = stages
+    try:
+        # Entries without all properties in the view are left out, the number of promises is
+        # limited to the ones left, and the work sets are split into batches
+        work_sets = get_work_sets(artifacts, None, params)
+        assert work_sets[0:2] == [["f1\n"], ["f1\n", "f2\n"]]
+        assert len(work_sets[2]) == 1 and '"f4"' in work_sets[2][0]
+        assert work_sets[3] == [""]
+        assert get_work_sets(artifacts, [{'eig_file': {'f2', 'f3'}}], params)[0:2] == [
+            ["f2\nf3\n"], ["f2\n"]]
+
+        # The stages sharing a resource and the batches of a stage don't run at the same time
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cmd = (f"mkdir {tmpdir}/busy || exit 1; cat >> {tmpdir}/out; sleep 0.2; "
+                   f"rmdir {tmpdir}/busy")
+            stage = {'name': 'busy', 'command': ['sh', '-c', cmd], 'resource': 'r'}
+            resource_locks = {}
+            with contextlib.redirect_stderr(io.StringIO()):
+                with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+                    futures = [executor.submit(run_stage, stage, batches, params,
+                                               resource_locks, False)
+                               for batches in (["a\n", "b\n"], ["c\n"])]
+                    assert all([f.result() for f in futures])
+                assert not run_stage(dict(stage, command=['false']), ["a\n"], params,
+                                     resource_locks, False)
+            with open(f"{tmpdir}/out", 'rt') as f:
+                assert sorted(f.read().splitlines()) == ["a", "b", "c"]
+
+        # The cycles are more frequent while the entries change, and a stage runs again only if
+        # its work set changed
+        scopes = [artifacts, artifacts, artifacts, artifacts[1:], artifacts[1:]]
+        intervals = []
+        old_execute_schema_by_id, old_sleep = kaon.execute_schema_by_id, time.sleep
+
+        def sleep(interval):
+            intervals.append(interval)
+            if not scopes:
+                raise StopIteration
+
+        kaon.execute_schema_by_id = lambda schema, env, jobs: dict(enumerate(scopes.pop(0)))
+        time.sleep = sleep
+        out = io.StringIO()
+        try:
+            with contextlib.redirect_stdout(out), contextlib.redirect_stderr(io.StringIO()):
+                run_workflow([], None, {}, params, 1, 4, 3600, 1, once=False, dry_run=True)
+            assert False
+        except StopIteration:
+            pass
+        finally:
+            kaon.execute_schema_by_id, time.sleep = old_execute_schema_by_id, old_sleep
+        assert intervals == [2, 4, 4, 1, 2]
+        assert [line for line in out.getvalue().splitlines() if line.startswith("# promise")] == [
+            "# promise: true", "# promise: true"]
+    finally:
+        STAGES = old_stages
+
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 2 and sys.argv[1] == '--test':
+        do_test()
+    else:
+        process_args()
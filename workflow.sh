@@ -18,33 +18,45 @@ max_eig_promises="0"
 # Set scope, work with configurations and eigenvector from a stream and a range of trajectories
 scope="facilities.json ensemble.json artifacts.json --constrains goals-facility.json --JLAB_REMOTE ${JLAB_REMOTE} --LOCAL_CACHE ${LOCAL_CACHE} --LOCAL_RUN ${LOCAL_RUN}"
 
+# The entries of the scope are kept in a database, so that the queries don't execute the scope again
+query="facilities.json ensemble.json artifacts.json --constrains goals-facility.json --store sqlite:scope.db --from-store"
+
+# Time of the last compaction of the logs of promises
+last_compaction="0"
+
 # Iteratively run the following steps until the number of configuration without an eigenvector is zero
 while true ; do
 	# a) Capture all information about the goals
-	./kaon.py $scope --output-format schema > scope.json
+	./kaon.py $scope --store sqlite:scope.db > /dev/null
 	exit 0
 
 	# b) Copy back configurations and eigenvectors that are not at jlab's tape
-	./kaon.py scope.json --cfg_file_remote_status promised none --cfg_file_status "local" --show cfg_file | kaon-remote-cp.sh here jlab
-	./kaon.py scope.json --eig_file_remote_status promised none --eig_file_status "local" --show eig_file | kaon-remote-cp.sh here jlab
+	./kaon.py $query --cfg_file_remote_status promised none --cfg_file_status "local" --show cfg_file | kaon-remote-cp.sh here jlab
+	./kaon.py $query --eig_file_promiser $THIS_FACILITY --eig_file_status "local" --eig_file_checksum_status unverified --show eig_file | ./verify_checksums.py --write > /dev/null
+	./kaon.py $query --eig_file_remote_status promised none --eig_file_status "local" --eig_file_checksum_status verified --show eig_file | kaon-remote-cp.sh here jlab
 
 	# b) Remove promises for local eigenvectors that are at jlab
-	./kaon.py scope.json --eig_file_remote_status promised --eig_file_promiser $THIS_FACILITY --eig_file_status "local" --show eig_file | kaon-rm-promise.sh
+	./kaon.py $query --eig_file_remote_status promised --eig_file_promiser $THIS_FACILITY --eig_file_status "local" --eig_file_checksum_status verified --show eig_file | kaon-rm-promise.sh $THIS_FACILITY
 
 	# c) Promise up to some number of eigenvectors to compute
-	num_promises="`./kaon.py scope.json --eig_file_promiser $THIS_FACILITY --show eig_file | wc -l`"
+	num_promises="`./kaon.py $query --eig_file_promiser $THIS_FACILITY --show eig_file | wc -l`"
 	if [ $num_promises -lt $max_eig_promises ]; then
-		./kaon.py scope.json --eig_file_remote_status none --eig_file_status none --show eig_file | head -$(( max_eig_promises - num_promises )) | kaon-promise.sh
+		./kaon.py $query --eig_file_remote_status none --eig_file_status none --show eig_file | head -$(( max_eig_promises - num_promises )) | kaon-promise.sh $THIS_FACILITY
 	fi
 
 	# d) Bring to cache configurations that doesn't have an eigenvector file associated and are on tape
-	./kaon.py scope.json --cfg_file_remote_status tape --cfg_file_status none --eig_file_remote_status promised --eig_file_promiser $THIS_FACILITY --eig_file_status none --show cfg_file | kaon-get-from-tape-remote.sh
+	./kaon.py $query --cfg_file_remote_status tape --cfg_file_status none --eig_file_remote_status promised --eig_file_promiser $THIS_FACILITY --eig_file_status none --show cfg_file | kaon-get-from-tape-remote.sh ${max_promises}
 	
 	# e) Bring to this facility configurations that doesn't have an eigenvector file associated and are on cache at jlab
-	./kaon.py scope.json --cfg_file_remote_status cache --cfg_file_status none --eig_file_remote_status promised --eig_file_promiser $THIS_FACILITY --eig_file_status none --show cfg_file | kaon-remote-cp.sh jlab here
+	./kaon.py $query --cfg_file_remote_status cache --cfg_file_status none --eig_file_remote_status promised --eig_file_promiser $THIS_FACILITY --eig_file_status none --show cfg_file | kaon-remote-cp.sh jlab here
 	
 	# f) Create eigenvectors from configurations that are local and doesn't have an eigenvector file associated
-	./kaon.py scope.json --cfg_file_status "local" --eig_file_remote_status promised --eig_file_promiser $THIS_FACILITY --eig_file_status none --show cfg_file smear_fact smear_num default_vecs eig_default_file --output-format schema | launch-eigs.sh
+	./kaon.py $query --cfg_file_status "local" --eig_file_remote_status promised --eig_file_promiser $THIS_FACILITY --eig_file_status none --show cfg_file smear_fact smear_num default_vecs eig_default_file --output-format schema | launch-eigs.sh
+
+	# g) Compact the logs of promises once a day
+	if [ $(( `date +%s` - last_compaction )) -ge $(( 24 * 60 * 60 )) ]; then
+		./kaon-compact-promises.sh && last_compaction="`date +%s`"
+	fi
 
 	# Wait a bit, pal, things move slowly and we don't need to react at every second
 	sleep $(( 30 * 60 ))